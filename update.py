@@ -24,16 +24,28 @@ COST: ~$4-8/month (Claude Haiku 4.5, 4 calls/day + 4 web search calls/day)
 """
 
 import glob
+import hashlib
 import json
 import math
 import os
 import re
 import sys
+import tempfile
+import threading
 import time
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from html import escape, unescape
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
 
 # ──────────────────────────────────────────────────────────────
 # CONFIG
@@ -45,6 +57,73 @@ OPENSKY_CLIENT_SECRET = os.environ.get("OPENSKY_CLIENT_SECRET", "")
 
 HISTORY_DIR = os.path.join(os.path.dirname(__file__) or ".", "history")
 HISTORY_RETENTION_DAYS = 30
+# Validators + parsed payloads from the last run, for conditional GETs (committed with history/)
+HTTP_CACHE_DIR = os.path.join(os.path.dirname(__file__) or ".", ".http_cache")
+# Max age of a cached Claude analysis that may be reused when its input fingerprint still matches
+ANALYSIS_REUSE_HOURS = 24
+# Wall-clock budget for the streamed analysis before the rule-based fallback takes over
+ANALYSIS_TIMEOUT_S = 120
+# Longest Retry-After wait honoured before a retry, so one throttled host can't stall the run
+RETRY_AFTER_MAX_S = 30
+
+# Client-side request pacing, one bucket per quota-limited host (see RATE_LIMITS)
+class TokenBucket:
+    """Thread-safe token bucket; take() blocks until a request to the bucket's host may go out."""
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.stamp = float(burst), time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate) - 1
+            self.stamp = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait: time.sleep(wait)
+
+# Self-imposed request rates (per host suffix) for the quota-limited APIs, so a manual
+# re-run or a wider fan-out paces itself instead of burning quota on 429s
+RATE_LIMITS = {
+    "opensky-network.org": TokenBucket(rate=4/60, burst=4),
+    "polymarket.com": TokenBucket(rate=10/60, burst=5),
+}
+
+class _PacedAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+        host = urlsplit(request.url).hostname or ""
+        for suffix, bucket in RATE_LIMITS.items():
+            if host == suffix or host.endswith("." + suffix):
+                bucket.take()
+                break
+        return super().send(request, **kwargs)
+
+# urllib3 only grew retry_after_max in 2.7 and the runner installs whatever requests pulls in
+class _CappedRetry(Retry):
+    def parse_retry_after(self, retry_after):
+        return min(super().parse_retry_after(retry_after), RETRY_AFTER_MAX_S)
+
+# One pooled session for every fetcher, so repeat calls to a host (OpenSky auth →
+# states, USNI index → article) reuse the open TLS connection. Transient upstream
+# failures (rate limits, gateway errors, Anthropic 529 overload) are retried with
+# backoff before a fetcher gives up and the briefing degrades.
+SESSION = requests.Session()
+# Advertise every encoding urllib3 can decode here (gzip/deflate, plus br/zstd when those modules exist)
+SESSION.headers.update({"User-Agent": "IranWatch/2.0", **make_headers(accept_encoding=True)})
+_adapter = _PacedAdapter(pool_connections=8, pool_maxsize=8, max_retries=_CappedRetry(
+    total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504, 529],
+    allowed_methods=["GET"], respect_retry_after_header=True, raise_on_status=False))
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+# POSTs (the billed Claude calls, the OpenSky token grant) are re-sent only on a status saying the
+# request was turned away — never after a dropped connection or read timeout, when it may have run
+_post_adapter = _PacedAdapter(pool_connections=8, pool_maxsize=8, max_retries=_CappedRetry(
+    total=3, connect=0, read=0, other=0, backoff_factor=0.5, status_forcelist=[429, 503, 529],
+    allowed_methods=["POST"], respect_retry_after_header=True, raise_on_status=False))
+SESSION.mount("https://api.anthropic.com/", _post_adapter)
+SESSION.mount("https://auth.opensky-network.org/", _post_adapter)
+
+M_TO_FT = 3.28084
 
 # Bounding box: Europe through South Asia
 ME_BBOX = {"lamin": 10, "lamax": 55, "lomin": -10, "lomax": 70}
@@ -74,6 +153,9 @@ MIL_PREFIXES = [
     # Generic patterns
     "GOLD", "SHADOW", "TORCH", "TABOR",
 ]
+# Prefix match as a few set lookups (one per distinct prefix length) instead of a startswith per prefix
+_MIL_PREFIX_SET = frozenset(MIL_PREFIXES)
+_MIL_PREFIX_LENS = sorted({len(p) for p in MIL_PREFIXES})
 
 CALLSIGN_AIRFRAMES = {
     # US Airlift
@@ -173,35 +255,52 @@ _ICAO_TYPE_MAP = {
     "VC25":("VC-25A (Air Force One)","Presidential transport"),
 }
 
+# Distinct prefix lengths, longest first, so a lookup is a few dict probes and the longest prefix wins
+_AIRFRAME_PREFIX_LENS = sorted({len(p) for p in CALLSIGN_AIRFRAMES}, reverse=True)
+
 def identify_airframe(callsign):
     if not callsign: return None
     cs = callsign.upper()
-    for prefix, info in CALLSIGN_AIRFRAMES.items():
-        if cs.startswith(prefix): return info
+    for n in _AIRFRAME_PREFIX_LENS:
+        info = CALLSIGN_AIRFRAMES.get(cs[:n])
+        if info: return info
     return None
 
+# Fuzzy type-code matching without a scan: the earliest _ICAO_TYPE_MAP key that is a prefix of
+# the code (probed by key length) or that the code is a prefix of (precomputed per key prefix)
+_ICAO_KEY_ORDER = {k: i for i, k in enumerate(_ICAO_TYPE_MAP)}
+_ICAO_KEY_LENS = sorted({len(k) for k in _ICAO_TYPE_MAP})
+_ICAO_BY_PREFIX = {}
+for _k in _ICAO_TYPE_MAP:
+    for _n in range(len(_k) + 1):
+        _ICAO_BY_PREFIX.setdefault(_k[:_n], _k)
+
+# A fleet shares a handful of type codes (a dozen C17s, K35Rs...), so memoise the pure lookup for the run
+@lru_cache(maxsize=1024)
 def _resolve_icao_type(type_code):
     if not type_code: return None
     tc = type_code.upper().replace("-", "")
     if tc in _ICAO_TYPE_MAP: return _ICAO_TYPE_MAP[tc]
-    for key, val in _ICAO_TYPE_MAP.items():
-        if tc.startswith(key) or key.startswith(tc): return val
-    return None
+    keys = [tc[:n] for n in _ICAO_KEY_LENS if n <= len(tc) and tc[:n] in _ICAO_TYPE_MAP]
+    if tc in _ICAO_BY_PREFIX: keys.append(_ICAO_BY_PREFIX[tc])
+    return _ICAO_TYPE_MAP[min(keys, key=_ICAO_KEY_ORDER.get)] if keys else None
+
+# ICAO 24-bit address blocks (non-overlapping), sorted by start for a bisect lookup
+_HEX_BLOCKS = sorted([
+    (0xA00000, 0xAFFFFF, "United States"), (0x400000, 0x43FFFF, "United Kingdom"),
+    (0x3C0000, 0x3FFFFF, "Germany"), (0x380000, 0x3BFFFF, "France"),
+    (0x300000, 0x33FFFF, "Italy"), (0x340000, 0x37FFFF, "Spain"),
+    (0x4C0000, 0x4CFFFF, "Turkey"), (0x738000, 0x73FFFF, "Israel"),
+    (0x700000, 0x70FFFF, "Saudi Arabia"), (0x500000, 0x507FFF, "Australia"),
+    (0xC00000, 0xC3FFFF, "Canada"),
+])
+_HEX_STARTS = [lo for lo, _, _ in _HEX_BLOCKS]
 
 def _country_from_hex(hex_code):
     try: h = int(hex_code, 16)
     except (ValueError, TypeError): return ""
-    if 0xA00000 <= h <= 0xAFFFFF: return "United States"
-    if 0x400000 <= h <= 0x43FFFF: return "United Kingdom"
-    if 0x3C0000 <= h <= 0x3FFFFF: return "Germany"
-    if 0x380000 <= h <= 0x3BFFFF: return "France"
-    if 0x300000 <= h <= 0x33FFFF: return "Italy"
-    if 0x340000 <= h <= 0x37FFFF: return "Spain"
-    if 0x4C0000 <= h <= 0x4CFFFF: return "Turkey"
-    if 0x738000 <= h <= 0x73FFFF: return "Israel"
-    if 0x700000 <= h <= 0x70FFFF: return "Saudi Arabia"
-    if 0x500000 <= h <= 0x507FFF: return "Australia"
-    if 0xC00000 <= h <= 0xC3FFFF: return "Canada"
+    i = bisect_right(_HEX_STARTS, h) - 1
+    if i >= 0 and h <= _HEX_BLOCKS[i][1]: return _HEX_BLOCKS[i][2]
     return ""
 
 
@@ -209,17 +308,37 @@ def _country_from_hex(hex_code):
 # OAUTH2 (for OpenSky fallback)
 # ──────────────────────────────────────────────────────────────
 
+# Tokens live ~30 min; kept outside the repo (runner temp) so local re-runs skip the auth call.
+_OPENSKY_TOKEN_CACHE = os.path.join(os.environ.get("RUNNER_TEMP") or tempfile.gettempdir(), ".opensky_token.json")
+
 def get_opensky_token():
     if not OPENSKY_CLIENT_ID or not OPENSKY_CLIENT_SECRET: return None
     try:
-        resp = requests.post(
+        with open(_OPENSKY_TOKEN_CACHE) as f:
+            cached = json.load(f)
+        if cached.get("client_id") == OPENSKY_CLIENT_ID and time.time() < cached["expires_at"] - 60:
+            return cached["access_token"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    try:
+        resp = SESSION.post(
             "https://auth.opensky-network.org/auth/realms/opensky-network/protocol/openid-connect/token",
             data={"grant_type": "client_credentials",
                   "client_id": OPENSKY_CLIENT_ID,
                   "client_secret": OPENSKY_CLIENT_SECRET},
             timeout=15)
         resp.raise_for_status()
-        return resp.json().get("access_token")
+        data = resp.json()
+        token = data.get("access_token")
+        if token and data.get("expires_in"):
+            try:
+                fd = os.open(_OPENSKY_TOKEN_CACHE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"client_id": OPENSKY_CLIENT_ID, "access_token": token,
+                               "expires_at": time.time() + data["expires_in"]}, f)
+            except OSError:
+                pass
+        return token
     except Exception as e:
         print(f"[OpenSky] OAuth2 error: {e}")
         return None
@@ -280,26 +399,58 @@ _COUNTRY_BOXES = [
     (36.0,44.0,-9.5,3.5,"Spain"),(35.0,42.0,19.5,30.0,"Greece"),
 ]
 
-def _haversine_nm(lat1, lon1, lat2, lon2):
-    R = 3440.065
-    dlat, dlon = math.radians(lat2-lat1), math.radians(lon2-lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1))*math.cos(math.radians(lat2))*math.sin(dlon/2)**2
-    return R * 2 * math.asin(math.sqrt(a))
+# Reference points in radians with cos(lat) precomputed, for the nearest-point scan
+_REF_RAD = [(math.radians(rlat), math.radians(rlon), math.cos(math.radians(rlat)), rname)
+            for rlat, rlon, rname in _REFERENCE_POINTS]
+
+# 5° grid: each cell lists the reference points in its 3×3 neighbourhood (in table order, so ties
+# break as in a full scan). Anything outside that block is ≥5° away — over 100 nm at these
+# latitudes — so a neighbourhood winner under 100 nm is the true nearest point.
+_REF_CELL_DEG, _REF_GRID_SAFE_NM, _REF_GRID_MAX_LAT = 5, 100, 55
+_REF_GRID = {}
+for _ref, (_rlat, _rlon, _) in zip(_REF_RAD, _REFERENCE_POINTS):
+    _ci, _cj = math.floor(_rlat / _REF_CELL_DEG), math.floor(_rlon / _REF_CELL_DEG)
+    for _di in (-1, 0, 1):
+        for _dj in (-1, 0, 1):
+            _REF_GRID.setdefault((_ci + _di, _cj + _dj), []).append(_ref)
+
+# Same 5° cells for the water/country boxes: each cell lists, in table order, the boxes that
+# overlap it, so a lookup tests only the handful that could contain the point
+def _box_grid(boxes):
+    grid = {}
+    for box in boxes:
+        for ci in range(math.floor(box[0] / _REF_CELL_DEG), math.floor(box[1] / _REF_CELL_DEG) + 1):
+            for cj in range(math.floor(box[2] / _REF_CELL_DEG), math.floor(box[3] / _REF_CELL_DEG) + 1):
+                grid.setdefault((ci, cj), []).append(box)
+    return grid
+
+_WATER_GRID, _COUNTRY_GRID = _box_grid(_WATER_BODIES), _box_grid(_COUNTRY_BOXES)
+
+def _nearest_ref(lat_r, lon_r, refs):
+    """(distance nm, name) of the closest of refs, ranked by the haversine term (monotonic in distance)."""
+    cos_lat, sin, best_a, nearest = math.cos(lat_r), math.sin, 2.0, None
+    for rlat, rlon, rcos, rname in refs:
+        a = sin((rlat - lat_r) / 2) ** 2 + cos_lat * rcos * sin((rlon - lon_r) / 2) ** 2
+        if a < best_a: best_a, nearest = a, rname
+    return (3440.065 * 2 * math.asin(math.sqrt(best_a)), nearest) if nearest else (999999, None)
 
 def describe_location(lat, lon):
-    if not lat or not lon: return "unknown"
-    nearest_ref, nearest_dist = None, 999999
-    for rlat, rlon, rname in _REFERENCE_POINTS:
-        d = _haversine_nm(lat, lon, rlat, rlon)
-        if d < nearest_dist: nearest_dist, nearest_ref = d, rname
+    if lat is None or lon is None: return "unknown"
+    lat_r, lon_r = math.radians(lat), math.radians(lon)
+    nearest_dist, nearest_ref = 999999, None
+    cell = (math.floor(lat / _REF_CELL_DEG), math.floor(lon / _REF_CELL_DEG))
+    if abs(lat) <= _REF_GRID_MAX_LAT:
+        nearest_dist, nearest_ref = _nearest_ref(lat_r, lon_r, _REF_GRID.get(cell, ()))
+    if nearest_dist >= _REF_GRID_SAFE_NM:
+        nearest_dist, nearest_ref = _nearest_ref(lat_r, lon_r, _REF_RAD)
     if nearest_dist < 30:
         miles = round(nearest_dist * 1.151)
         return f"near {nearest_ref}" if miles < 10 else f"~{miles} mi from {nearest_ref}"
-    for wlat_min, wlat_max, wlon_min, wlon_max, wname in _WATER_BODIES:
+    for wlat_min, wlat_max, wlon_min, wlon_max, wname in _WATER_GRID.get(cell, ()):
         if wlat_min <= lat <= wlat_max and wlon_min <= lon <= wlon_max:
             if nearest_dist < 60: return f"over {wname}, ~{round(nearest_dist*1.151)} mi from {nearest_ref}"
             return f"over {wname}"
-    for clat_min, clat_max, clon_min, clon_max, cname in _COUNTRY_BOXES:
+    for clat_min, clat_max, clon_min, clon_max, cname in _COUNTRY_GRID.get(cell, ()):
         if clat_min <= lat <= clat_max and clon_min <= lon <= clon_max:
             if nearest_dist < 100: return f"over {cname}, ~{round(nearest_dist*1.151)} mi from {nearest_ref}"
             return f"over {cname}"
@@ -311,74 +462,139 @@ def describe_location(lat, lon):
 # HISTORY MANAGEMENT
 # ──────────────────────────────────────────────────────────────
 
-def load_history(days=7):
+# One JSON object per line, oldest first, each led by its "_timestamp" — appended each run
+# instead of one file per snapshot, so a 7-day load is a single open
+HISTORY_FILE = os.path.join(HISTORY_DIR, "snapshots.jsonl")
+
+def _migrate_legacy_snapshots():
+    """Fold any old one-file-per-snapshot history into HISTORY_FILE, then remove those files."""
+    legacy = []
+    for fp in glob.glob(os.path.join(HISTORY_DIR, "*.json")):
+        try:
+            ts = datetime.fromisoformat(os.path.basename(fp)[:-5].replace("_", ":"))
+            with open(fp) as f:
+                data = json.load(f)
+        except (ValueError, OSError):
+            continue
+        if ts.tzinfo: legacy.append((ts, fp, data))
+    if not legacy: return
+    legacy.sort(key=lambda t: t[0])
+    merged = {ts.isoformat(): data for ts, _, data in legacy}
+    for line in _history_lines():
+        merged.setdefault(line[0], line[1])
+    _rewrite_history(sorted(merged.items()))
+    for _, fp, _ in legacy:
+        try:
+            os.remove(fp)
+        except OSError:
+            pass
+    print(f"[History] Migrated {len(legacy)} snapshot files into {HISTORY_FILE}")
+
+def _history_lines():
+    """(iso timestamp, snapshot) per line of HISTORY_FILE; a torn or corrupt line is skipped."""
+    out = []
+    try:
+        with open(HISTORY_FILE, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                    out.append((data.pop("_timestamp"), data))
+                except (ValueError, KeyError, AttributeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return out
+
+def _history_line(ts, data):
+    return json.dumps({"_timestamp": ts, **data}, separators=(",", ":")) + "\n"
+
+def _rewrite_history(entries):
+    # Write beside the target and swap in, so a crash never leaves a truncated history
+    tmp = HISTORY_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(_history_line(ts, data) for ts, data in entries)
+    os.replace(tmp, HISTORY_FILE)
+
+def load_history(days=7, now=None):
     """Load historical snapshots from the last N days."""
     os.makedirs(HISTORY_DIR, exist_ok=True)
-    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    _migrate_legacy_snapshots()
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=days)
     snapshots = []
-    for fp in sorted(glob.glob(os.path.join(HISTORY_DIR, "*.json"))):
+    for ts, data in _history_lines():
         try:
-            fname = os.path.basename(fp)
-            ts_str = fname.replace(".json", "")
-            ts = datetime.fromisoformat(ts_str.replace("_", ":"))
-            if ts >= cutoff:
-                with open(fp) as f:
-                    data = json.load(f)
-                    data["_timestamp"] = ts.isoformat()
-                    snapshots.append(data)
-        except Exception:
+            if datetime.fromisoformat(ts) < cutoff: continue
+        except (TypeError, ValueError):
             continue
+        data["_timestamp"] = ts
+        snapshots.append(data)
     print(f"[History] Loaded {len(snapshots)} snapshots from last {days} days")
     return snapshots
 
-def save_snapshot(data):
-    """Save a timestamped snapshot."""
+def save_snapshot(data, now=None):
+    """Append a timestamped snapshot to HISTORY_FILE."""
     os.makedirs(HISTORY_DIR, exist_ok=True)
-    ts = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H_%M_%S+00_00")
-    fp = os.path.join(HISTORY_DIR, f"{ts}.json")
-    with open(fp, "w") as f:
-        json.dump(data, f)
-    print(f"[History] Saved snapshot to {fp}")
-
-def cleanup_old_history():
-    """Remove snapshots older than retention period."""
-    cutoff = datetime.now(timezone.utc) - timedelta(days=HISTORY_RETENTION_DAYS)
-    removed = 0
-    for fp in glob.glob(os.path.join(HISTORY_DIR, "*.json")):
+    ts = (now or datetime.now(timezone.utc)).replace(microsecond=0).isoformat()
+    line = _history_line(ts, data).encode("utf-8")
+    with open(HISTORY_FILE, "ab+") as f:
+        # A run killed mid-append leaves a line without its newline; start on a fresh one
+        # so only that torn line is lost, not this one too
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n": line = b"\n" + line
+        f.write(line)
+    print(f"[History] Appended snapshot {ts} to {HISTORY_FILE}")
+
+def cleanup_old_history(now=None):
+    """Drop snapshots older than the retention period; the file is rewritten at most once a day."""
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=HISTORY_RETENTION_DAYS)
+    entries = _history_lines()
+    # Lines are in time order, so the first one says whether anything has been expired for
+    # a day yet; until then the rewrite is skipped and the few stale lines ride along
+    try:
+        if not entries or datetime.fromisoformat(entries[0][0]) >= cutoff - timedelta(days=1): return
+    except (TypeError, ValueError):
+        pass
+    kept = []
+    for ts, data in entries:
         try:
-            fname = os.path.basename(fp)
-            ts_str = fname.replace(".json", "")
-            ts = datetime.fromisoformat(ts_str.replace("_", ":"))
-            if ts < cutoff:
-                os.remove(fp)
-                removed += 1
-        except Exception:
+            if datetime.fromisoformat(ts) >= cutoff: kept.append((ts, data))
+        except (TypeError, ValueError):
             continue
-    if removed: print(f"[History] Cleaned up {removed} old snapshots")
+    _rewrite_history(kept)
+    print(f"[History] Cleaned up {len(entries) - len(kept)} old snapshots")
 
-def compute_trends(snapshots, current_markets):
+def compute_trends(snapshots, current_markets, now=None):
     """Compute 24h and 7d probability trends for prediction markets."""
     if not snapshots: return {}
-    now = datetime.now(timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    # Only snapshots inside the 24h/7d windows matter. Walk those youngest first so the newest
+    # reading per question and window wins; each current market is then two dict lookups.
+    in_window = []
+    for snap in snapshots:
+        try:
+            age_h = (now - datetime.fromisoformat(snap["_timestamp"])).total_seconds() / 3600
+        except Exception:
+            continue
+        if 20 <= age_h <= 30 or 144 <= age_h <= 192: in_window.append((age_h, snap))
+    in_window.sort(key=lambda x: x[0])
+    at_24h, at_7d = {}, {}
+    for age_h, snap in in_window:
+        window = at_24h if age_h <= 30 else at_7d
+        # Within a snapshot the first listing of a question counts, readings or not
+        seen = set()
+        for pm in snap.get("markets", []):
+            q = pm.get("question")
+            if q in seen: continue
+            seen.add(q)
+            if pm.get("probability") is not None: window.setdefault(q, pm["probability"])
     trends = {}
     for m in current_markets:
-        q = m.get("question", "")
-        h24_val, h7d_val = None, None
-        for snap in reversed(snapshots):
-            try:
-                ts = datetime.fromisoformat(snap["_timestamp"])
-                age_h = (now - ts).total_seconds() / 3600
-                for pm in snap.get("markets", []):
-                    if pm.get("question") == q:
-                        if 20 <= age_h <= 30 and h24_val is None:
-                            h24_val = pm.get("probability")
-                        if 144 <= age_h <= 192 and h7d_val is None:
-                            h7d_val = pm.get("probability")
-            except Exception:
-                continue
+        q, prob = m.get("question", ""), m["probability"]
+        h24_val, h7d_val = at_24h.get(q), at_7d.get(q)
         trends[q] = {
-            "delta_24h": m["probability"] - h24_val if h24_val is not None else None,
-            "delta_7d": m["probability"] - h7d_val if h7d_val is not None else None,
+            "delta_24h": prob - h24_val if h24_val is not None else None,
+            "delta_7d": prob - h7d_val if h7d_val is not None else None,
             "prev_24h": h24_val,
             "prev_7d": h7d_val,
         }
@@ -399,29 +615,77 @@ def compute_aircraft_baseline(snapshots):
 # DATA FETCHERS
 # ──────────────────────────────────────────────────────────────
 
+def _load_http_cache(name):
+    try:
+        with open(os.path.join(HTTP_CACHE_DIR, f"{name}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _conditional_headers(cache, url):
+    """If-None-Match / If-Modified-Since for url, if the last run cached validators for it."""
+    if cache.get("url") != url: return {}
+    cond = {}
+    if cache.get("etag"): cond["If-None-Match"] = cache["etag"]
+    if cache.get("last_modified"): cond["If-Modified-Since"] = cache["last_modified"]
+    return cond
+
+def _write_http_cache(name, data):
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    fp = os.path.join(HTTP_CACHE_DIR, f"{name}.json")
+    with open(fp + ".tmp", "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(fp + ".tmp", fp)
+
+def _save_http_cache(name, url, resp, payload):
+    etag, last_mod = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    if not etag and not last_mod: return
+    _write_http_cache(name, {"url": url, "etag": etag, "last_modified": last_mod, "payload": payload})
+
+def cached_fetch(name, fn, items_key, ttl=3600, stale_ttl=86400):
+    """Stale-while-revalidate around a fetcher: a fresh cached result is returned as-is,
+    a failed refresh falls back to the cached result (status "stale") while it is under stale_ttl.
+    A refresh whose items_key list came back empty counts as failed when the cache has items —
+    an outage can look like an empty answer, and must not wipe the last good entry.
+    Age comes from the stored timestamp, not mtime — a fresh checkout resets mtimes."""
+    entry = _load_http_cache(name)
+    age = time.time() - entry.get("fetched_at", 0)
+    cached = entry.get("payload") if age < stale_ttl else None
+    if cached and age < ttl:
+        print(f"[Cache] {name}: fresh ({age/60:.0f}m old)")
+        return cached
+    result = fn()
+    had_items = bool((entry.get("payload") or {}).get(items_key))
+    if result.get("status") == "ok" and (result.get(items_key) or not had_items):
+        _write_http_cache(name, {"fetched_at": time.time(), "payload": result})
+    elif cached:
+        print(f"[Cache] {name}: fetch failed, serving {age/3600:.1f}h-old cached result")
+        return {**cached, "status": "stale", "error": result.get("error") or "refresh returned no results"}
+    return result
+
 def fetch_aircraft():
     """Fetch military aircraft from airplanes.live /mil endpoint."""
     print("[airplanes.live] Fetching military aircraft...")
     try:
-        resp = requests.get("https://api.airplanes.live/v2/mil", timeout=30)
+        resp = SESSION.get("https://api.airplanes.live/v2/mil", timeout=30)
         resp.raise_for_status()
         data = resp.json()
         all_mil = data.get("ac", [])
         print(f"[airplanes.live] Global military aircraft: {len(all_mil)}")
 
         mil_aircraft = []
+        lamin, lamax, lomin, lomax = ME_BBOX["lamin"], ME_BBOX["lamax"], ME_BBOX["lomin"], ME_BBOX["lomax"]
         for ac in all_mil:
-            lat, lon = ac.get("lat"), ac.get("lon")
-            if not lat or not lon: continue
-            if ac.get("alt_baro") == "ground": continue
-            if not (ME_BBOX["lamin"] <= lat <= ME_BBOX["lamax"] and
-                    ME_BBOX["lomin"] <= lon <= ME_BBOX["lomax"]): continue
+            # Cheap rejects first: most of the global feed is on the ground or outside the box
+            lat, lon, alt = ac.get("lat"), ac.get("lon"), ac.get("alt_baro")
+            if lat is None or lon is None or alt == "ground": continue
+            if not (lamin <= lat <= lamax and lomin <= lon <= lomax): continue
 
             callsign = (ac.get("flight") or "").strip().upper()
             hex_code = ac.get("hex", "")
             registration = ac.get("r", "")
             aircraft_type = ac.get("t", "")
-            alt_ft = ac.get("alt_baro") if isinstance(ac.get("alt_baro"), (int, float)) else None
+            alt_ft = alt if isinstance(alt, (int, float)) else None
             gs_knots = ac.get("gs")
 
             airframe = None
@@ -433,12 +697,13 @@ def fetch_aircraft():
                 "aircraft_type": aircraft_type, "origin": _country_from_hex(hex_code),
                 "lat": round(lat, 2), "lon": round(lon, 2), "alt_ft": alt_ft,
                 "gs_knots": round(gs_knots) if gs_knots else None,
-                "location_desc": describe_location(round(lat, 2), round(lon, 2)),
+                "location_desc": None,  # filled in below, only for the aircraft that are kept
                 "airframe": airframe[0] if airframe else (aircraft_type or "Unknown type"),
                 "role": airframe[1] if airframe else "Military",
             })
 
         mil_aircraft.sort(key=lambda a: (a["airframe"] == "Unknown type", -(a["alt_ft"] or 0)))
+        for a in mil_aircraft[:50]: a["location_desc"] = describe_location(a["lat"], a["lon"])
         print(f"[airplanes.live] Military in bounding box: {len(mil_aircraft)}")
         return {"status": "ok", "source": "airplanes.live", "total_aircraft": len(all_mil),
                 "mil_count": len(mil_aircraft), "mil_aircraft": mil_aircraft[:50]}
@@ -452,7 +717,7 @@ def _fetch_opensky_fallback():
         headers = {}
         token = get_opensky_token()
         if token: headers["Authorization"] = f"Bearer {token}"
-        resp = requests.get("https://opensky-network.org/api/states/all",
+        resp = SESSION.get("https://opensky-network.org/api/states/all",
             params={"lamin": ME_BBOX["lamin"], "lamax": ME_BBOX["lamax"],
                     "lomin": ME_BBOX["lomin"], "lomax": ME_BBOX["lomax"]},
             headers=headers, timeout=30)
@@ -460,14 +725,18 @@ def _fetch_opensky_fallback():
         all_ac = resp.json().get("states", []) or []
         mil = []
         for ac in all_ac:
-            cs = (ac[1] or "").strip().upper()
-            if ac[8] or not ac[6] or not ac[5]: continue
-            if not any(cs.startswith(p) for p in MIL_PREFIXES): continue
+            # State vector: icao24, callsign, origin_country, time_position, last_contact, lon, lat, baro_alt_m, on_ground, ...
+            icao, cs, origin, _, _, lon, lat, alt_m, on_ground = ac[:9]
+            # Cheap field checks first; only airborne, positioned, callsigned rows get normalised
+            if on_ground or lat is None or lon is None or not cs: continue
+            cs = cs.strip().upper()
+            if not any(cs[:n] in _MIL_PREFIX_SET for n in _MIL_PREFIX_LENS): continue
             af = identify_airframe(cs)
-            mil.append({"callsign": cs, "hex": ac[0], "registration": "", "aircraft_type": "",
-                "origin": ac[2] or "", "lat": round(ac[6],2), "lon": round(ac[5],2),
-                "alt_ft": round(ac[7]*3.281) if ac[7] else None,
-                "location_desc": describe_location(round(ac[6],2), round(ac[5],2)),
+            lat, lon = round(lat, 2), round(lon, 2)
+            mil.append({"callsign": cs, "hex": icao, "registration": "", "aircraft_type": "",
+                "origin": origin or "", "lat": lat, "lon": lon,
+                "alt_ft": round(alt_m * M_TO_FT) if alt_m is not None else None,
+                "location_desc": describe_location(lat, lon),
                 "airframe": af[0] if af else "Unknown type", "role": af[1] if af else "Military"})
         return {"status": "ok (OpenSky fallback)", "source": "opensky",
                 "total_aircraft": len(all_ac), "mil_count": len(mil), "mil_aircraft": mil[:30]}
@@ -475,49 +744,83 @@ def _fetch_opensky_fallback():
         return {"status": "error", "error": str(e), "mil_count": 0, "mil_aircraft": []}
 
 
+def _substring_re(terms):
+    return re.compile("|".join(map(re.escape, terms)))
+
+# Polymarket question gating and categorisation (plain substring matches on the lowercased question),
+# one compiled alternation per list instead of a Python loop over the terms
+_PM_EXCLUDE_RE = _substring_re(["world cup","soccer","football","olympics","gdp","inflation","bitcoin","crypto","stock","etf"])
+_PM_INCLUDE_RE = _substring_re(["iran","tehran","khamenei","irgc","fordow","natanz","strike","centcom","persian gulf",
+                                "strait of hormuz","nuclear","enrichment","regime change","us attack iran","us strike iran","bomb iran"])
+_PM_CATEGORY_RES = [  # first match wins
+    ("us_strike", _substring_re(["us strike","us attack","america strike","united states strike"])),
+    ("israel_strike", _substring_re(["israel strike","israel attack","idf strike","israeli strike"])),
+    ("ceasefire", _substring_re(["ceasefire","peace","deal","agreement","negotiat"])),
+    ("nuclear", _substring_re(["nuclear","enrichment","weapon","warhead"])),
+    ("conflict", _substring_re(["war","conflict","military","strike","attack"])),
+]
+
+# Date variants stripped from a question before dedup ("by March 2026", "in 2026", "June 30, 2026")
+_PM_DATE_RES = [re.compile(pat, re.I) for pat in (
+    r'\b(by|before|in|on|after)\s+(january|february|march|april|may|june|july|august|september|october|november|december)\s*\d{0,2},?\s*\d{0,4}',
+    r'\b(in|by|before|after)\s+\d{4}\b',
+    r'\b(january|february|march|april|may|june|july|august|september|october|november|december)\s+\d{1,2},?\s*\d{0,4}',
+)]
+
+def _first_price(raw):
+    """Yes-price in percent from an outcomePrices string like '["0.12", "0.88"]' — only the first
+    element is read, so no list or JSON parser per market. None if empty or malformed."""
+    if not isinstance(raw, str): raw = json.dumps(raw)
+    first = raw.partition(",")[0].strip(' []"')
+    try:
+        return round(float(first) * 100) if first else None
+    except ValueError:
+        return None
+
 def fetch_polymarket():
     """Fetch Iran-related prediction markets, deduplicated and categorised."""
     print("[Polymarket] Fetching Iran markets...")
     url = "https://gamma-api.polymarket.com/events"
+    tags = ["iran", "middle-east", "geopolitics", "us-foreign-policy"]
+
+    def _events(tag):
+        try:
+            resp = SESSION.get(url, params={"tag": tag, "active": "true", "closed": "false", "limit": 50}, timeout=15)
+            resp.raise_for_status()
+            return resp.json()
+        except Exception as e:
+            print(f"[Polymarket] Tag '{tag}' failed: {e}")
+            return None  # distinct from an empty answer, so a total outage reports as an error
+
     try:
         markets, seen_best = [], {}  # seen_best: norm_key -> (market_dict, volume)
-        for tag in ["iran", "middle-east", "geopolitics", "us-foreign-policy"]:
+        # Tag queries are independent: fetch them together, then merge in tag order so dedup ties resolve as before
+        with ThreadPoolExecutor(max_workers=len(tags)) as ex:
+            tag_events = list(ex.map(_events, tags))
+        if all(events is None for events in tag_events):
+            return {"status": "error", "error": "all tag queries failed", "markets": []}
+        for events in tag_events:
+            if events is None: continue
             try:
-                resp = requests.get(url, params={"tag": tag, "active": "true", "closed": "false", "limit": 50}, timeout=15)
-                resp.raise_for_status()
-                for ev in resp.json():
+                for ev in events:
                     for m in ev.get("markets", []):
                         q = (m.get("question") or "").lower()
-                        if any(x in q for x in ["world cup","soccer","football","olympics","gdp","inflation","bitcoin","crypto","stock","etf"]): continue
-                        if not any(kw in q for kw in ["iran","tehran","khamenei","irgc","fordow","natanz","strike","centcom","persian gulf","strait of hormuz","nuclear","enrichment","regime change","us attack iran","us strike iran","bomb iran"]): continue
-                        prices = json.loads(m.get("outcomePrices", "[]"))
-                        yes_price = round(float(prices[0]) * 100) if prices else None
+                        if _PM_EXCLUDE_RE.search(q) or not _PM_INCLUDE_RE.search(q): continue
+                        yes_price = _first_price(m.get("outcomePrices", "[]"))
                         if yes_price is None: continue
                         # Aggressive dedup: strip ALL date variants
                         norm = q.replace("?","").strip()
-                        norm = re.sub(r'\b(by|before|in|on|after)\s+(january|february|march|april|may|june|july|august|september|october|november|december)\s*\d{0,2},?\s*\d{0,4}', '', norm, flags=re.I)
-                        norm = re.sub(r'\b(in|by|before|after)\s+\d{4}\b', '', norm, flags=re.I)
-                        norm = re.sub(r'\b(january|february|march|april|may|june|july|august|september|october|november|december)\s+\d{1,2},?\s*\d{0,4}', '', norm, flags=re.I)
-                        norm = re.sub(r'\s+', ' ', norm).strip()
-                        cat = "other"
-                        if any(x in q for x in ["us strike","us attack","america strike","united states strike"]): cat = "us_strike"
-                        elif any(x in q for x in ["israel strike","israel attack","idf strike","israeli strike"]): cat = "israel_strike"
-                        elif any(x in q for x in ["ceasefire","peace","deal","agreement","negotiat"]): cat = "ceasefire"
-                        elif any(x in q for x in ["nuclear","enrichment","weapon","warhead"]): cat = "nuclear"
-                        elif any(x in q for x in ["war","conflict","military","strike","attack"]): cat = "conflict"
+                        for rx in _PM_DATE_RES: norm = rx.sub('', norm)
+                        norm = " ".join(norm.split())
+                        cat = next((c for c, rx in _PM_CATEGORY_RES if rx.search(q)), "other")
                         mkt = {"question": m.get("question",""), "probability": yes_price,
                             "volume": m.get("volume","0"), "url": f"https://polymarket.com/event/{ev.get('slug','')}",
                             "category": cat, "source": "polymarket"}
                         # Dedup: keep the most informative version (prefer non-zero probability,
                         # then highest probability — resolved/expired variants often show 0%)
-                        if norm in seen_best:
-                            prev_mkt, prev_score = seen_best[norm]
-                            # Score: non-zero prob gets +1000 bonus, then by probability, then by volume
-                            curr_score = (1000 if yes_price > 0 else 0) + yes_price + float(mkt.get("volume", 0)) / 1e9
-                            if curr_score > prev_score:
-                                seen_best[norm] = (mkt, curr_score)
-                        else:
-                            score = (1000 if yes_price > 0 else 0) + yes_price + float(mkt.get("volume", 0)) / 1e9
+                        # Score: non-zero prob gets +1000 bonus, then by probability, then by volume
+                        score = (1000 if yes_price > 0 else 0) + yes_price + float(mkt.get("volume", 0)) / 1e9
+                        if norm not in seen_best or score > seen_best[norm][1]:
                             seen_best[norm] = (mkt, score)
             except Exception: pass
         # Assemble from dedup groups
@@ -535,12 +838,12 @@ def fetch_kalshi():
     """Fetch Iran-related markets from Kalshi public API."""
     print("[Kalshi] Fetching markets...")
     try:
-        resp = requests.get("https://api.elections.kalshi.com/trade-api/v2/events",
+        resp = SESSION.get("https://api.elections.kalshi.com/trade-api/v2/events",
             params={"status": "open", "series_ticker": "IRAN"}, timeout=15,
             headers={"Accept": "application/json"})
         if resp.status_code != 200:
             # Try searching by keyword
-            resp = requests.get("https://api.elections.kalshi.com/trade-api/v2/events",
+            resp = SESSION.get("https://api.elections.kalshi.com/trade-api/v2/events",
                 params={"status": "open"}, timeout=15,
                 headers={"Accept": "application/json"})
         markets = []
@@ -548,7 +851,7 @@ def fetch_kalshi():
             data = resp.json()
             for ev in data.get("events", []):
                 title = (ev.get("title") or "").lower()
-                if any(kw in title for kw in ["iran", "strike iran", "attack iran"]):
+                if "iran" in title:  # also covers "strike iran" / "attack iran"
                     for m in ev.get("markets", []):
                         yes_price = m.get("yes_bid")
                         if yes_price is not None:
@@ -566,12 +869,16 @@ def fetch_kalshi():
         return {"status": "error", "error": str(e), "markets": []}
 
 
+# Search results are kept only if the title mentions one of these (substring match, so "iranian" counts)
+_METACULUS_KW_RE = _substring_re(["iran","tehran","irgc","natanz","fordow"])
+
 def fetch_metaculus():
     """Fetch Iran questions from Metaculus — known IDs + search."""
     print("[Metaculus] Fetching Iran questions...")
     KNOWN_IDS = [41594, 31498, 31327, 32764]
     questions = []
-    headers = {"Accept": "application/json", "User-Agent": "IranWatch/2.0"}
+    headers = {"Accept": "application/json"}
+    answered = []  # one entry per HTTP 200; none at all means Metaculus is down, not quiet
 
     def _extract_probability(q_data):
         """Try multiple JSON paths to find the community prediction probability."""
@@ -633,64 +940,72 @@ def fetch_metaculus():
                 if v is not None: return v
         return 0
 
-    try:
-        # Try known question IDs via both old (api2) and new (api) paths
-        api_paths = [
-            "https://www.metaculus.com/api2/questions/{qid}/",
-            "https://www.metaculus.com/api/posts/{qid}/",
-        ]
-        for qid in KNOWN_IDS:
-            for api_path in api_paths:
-                url = api_path.format(qid=qid)
-                try:
-                    resp = requests.get(url, timeout=10, headers=headers)
-                    if resp.status_code != 200:
-                        print(f"[Metaculus] {url} → HTTP {resp.status_code}")
-                        continue
-                    q = resp.json()
-                    title = _extract_title(q)
-                    status = _extract_status(q)
-                    prob = _extract_probability(q)
-                    forecasters = _extract_forecasters(q)
-                    print(f"[Metaculus] Q{qid}: title='{title[:50]}' status='{status}' prob={prob} forecasters={forecasters}")
-                    if prob is not None and status in ("open", "upcoming", "", "active"):
-                        questions.append({
-                            "question": title, "probability": round(prob * 100) if prob <= 1 else round(prob),
-                            "forecasters": forecasters,
-                            "url": f"https://www.metaculus.com/questions/{qid}/",
-                            "id": qid, "source": "metaculus",
-                        })
-                        break  # Got it from this path, don't try alternate
-                    elif prob is not None:
-                        print(f"[Metaculus] Q{qid}: skipped — status '{status}' not in allowed set")
-                        break
-                except Exception as e:
-                    print(f"[Metaculus] Q{qid} error at {url}: {e}")
-                    continue
+    # Try known question IDs via both old (api2) and new (api) paths
+    api_paths = [
+        "https://www.metaculus.com/api2/questions/{qid}/",
+        "https://www.metaculus.com/api/posts/{qid}/",
+    ]
 
-        # Search for additional questions
-        for term in ["iran strike", "iran nuclear", "iran attack"]:
+    def _fetch_known(qid):
+        for api_path in api_paths:
+            url = api_path.format(qid=qid)
             try:
-                resp = requests.get("https://www.metaculus.com/api2/questions/",
-                    params={"search": term, "status": "open", "limit": 10, "type": "binary", "order_by": "-activity"},
-                    timeout=15, headers=headers)
-                if resp.status_code == 200:
-                    for q in resp.json().get("results", []):
-                        title = (q.get("title") or "").lower()
-                        qid = q.get("id")
-                        if any(x.get("id") == qid for x in questions): continue
-                        if any(kw in title for kw in ["iran","tehran","irgc","natanz","fordow"]):
-                            prob = _extract_probability(q)
-                            if prob is not None:
-                                questions.append({"question": q.get("title",""),
-                                    "probability": round(prob * 100) if prob <= 1 else round(prob),
-                                    "forecasters": _extract_forecasters(q),
-                                    "url": f"https://www.metaculus.com/questions/{qid}/",
-                                    "id": qid, "source": "metaculus"})
-                else:
-                    print(f"[Metaculus] Search '{term}' → HTTP {resp.status_code}")
+                resp = SESSION.get(url, timeout=10, headers=headers)
+                if resp.status_code != 200:
+                    print(f"[Metaculus] {url} → HTTP {resp.status_code}")
+                    continue
+                q = resp.json()
+                answered.append(url)
+                title = _extract_title(q)
+                status = _extract_status(q)
+                prob = _extract_probability(q)
+                forecasters = _extract_forecasters(q)
+                print(f"[Metaculus] Q{qid}: title='{title[:50]}' status='{status}' prob={prob} forecasters={forecasters}")
+                if prob is not None and status in ("open", "upcoming", "", "active"):
+                    return {
+                        "question": title, "probability": round(prob * 100) if prob <= 1 else round(prob),
+                        "forecasters": forecasters,
+                        "url": f"https://www.metaculus.com/questions/{qid}/",
+                        "id": qid, "source": "metaculus",
+                    }  # Got it from this path, don't try alternate
+                elif prob is not None:
+                    print(f"[Metaculus] Q{qid}: skipped — status '{status}' not in allowed set")
+                    return None
             except Exception as e:
-                print(f"[Metaculus] Search error '{term}': {e}")
+                print(f"[Metaculus] Q{qid} error at {url}: {e}")
+        return None
+
+    try:
+        # Known IDs are independent lookups; run them together and keep KNOWN_IDS order
+        with ThreadPoolExecutor(max_workers=len(KNOWN_IDS)) as ex:
+            questions = [q for q in ex.map(_fetch_known, KNOWN_IDS) if q]
+
+        # Search for additional questions — one broad query (the results are keyword-filtered
+        # below anyway) instead of one request per narrower search term
+        try:
+            resp = SESSION.get("https://www.metaculus.com/api2/questions/",
+                params={"search": "iran", "status": "open", "limit": 30, "type": "binary", "order_by": "-activity"},
+                timeout=15, headers=headers)
+            if resp.status_code == 200:
+                answered.append("search")
+                for q in resp.json().get("results", []):
+                    title = (q.get("title") or "").lower()
+                    qid = q.get("id")
+                    if any(x.get("id") == qid for x in questions): continue
+                    if _METACULUS_KW_RE.search(title):
+                        prob = _extract_probability(q)
+                        if prob is not None:
+                            questions.append({"question": q.get("title",""),
+                                "probability": round(prob * 100) if prob <= 1 else round(prob),
+                                "forecasters": _extract_forecasters(q),
+                                "url": f"https://www.metaculus.com/questions/{qid}/",
+                                "id": qid, "source": "metaculus"})
+            else:
+                print(f"[Metaculus] Search → HTTP {resp.status_code}")
+        except Exception as e:
+            print(f"[Metaculus] Search error: {e}")
+        if not answered:
+            return {"status": "error", "error": "all Metaculus requests failed", "questions": []}
         print(f"[Metaculus] Found {len(questions)} Iran questions")
         return {"status": "ok", "questions": questions[:10]}
     except Exception as e:
@@ -698,18 +1013,35 @@ def fetch_metaculus():
         return {"status": "error", "error": str(e), "questions": []}
 
 
+# CDATA and plain <title> forms in one pass; CDATA titles win when the feed has any.
+# The lookaheads drop feed/channel titles ("CENTCOM" within the first 10 chars) inside the scan.
+_TITLE_RE = re.compile(r"<title>(?:<!\[CDATA\[(?![\s\S]{0,3}CENTCOM)(.*?)\]\]>|(?![\s\S]{0,3}CENTCOM)([^<]*))</title>")
+
 def fetch_centcom_rss():
     """Fetch latest CENTCOM press releases."""
     print("[CENTCOM] Fetching RSS feed...")
     try:
         headers = {"User-Agent": "IranWatch/2.0 (OSINT Monitor)"}
-        resp = requests.get("https://www.centcom.mil/RSS/", headers=headers, timeout=15)
+        cache = _load_http_cache("centcom")
+        url = "https://www.centcom.mil/RSS/"
+        resp = SESSION.get(url, headers={**headers, **_conditional_headers(cache, url)}, timeout=15)
         if resp.status_code == 403:
-            resp = requests.get("https://www.centcom.mil/MEDIA/PRESS-RELEASES/", headers=headers, timeout=15)
+            url = "https://www.centcom.mil/MEDIA/PRESS-RELEASES/"
+            resp = SESSION.get(url, headers={**headers, **_conditional_headers(cache, url)}, timeout=15)
+        if resp.status_code == 304:
+            print(f"[CENTCOM] Not modified; reusing {len(cache['payload'])} cached releases")
+            return {"status": "ok", "releases": cache["payload"]}
         resp.raise_for_status()
-        titles = re.findall(r"<title><!\[CDATA\[(.*?)\]\]></title>", resp.text)
-        if not titles: titles = re.findall(r"<title>(.*?)</title>", resp.text)
-        releases = [t.strip() for t in titles[:15] if t.strip() and "CENTCOM" not in t[:10]]
+        # CDATA titles win if the feed has any, else plain ones; stop
+        # scanning once 15 are in hand rather than matching the whole feed
+        cdata, plain = [], []
+        for c, p in (m.groups() for m in _TITLE_RE.finditer(resp.text)):
+            if c:
+                cdata.append(c)
+                if len(cdata) == 15: break
+            elif len(plain) < 15: plain.append(p or "")
+        releases = [t for t in (t.strip() for t in cdata or plain) if t]
+        _save_http_cache("centcom", url, resp, releases)
         print(f"[CENTCOM] Found {len(releases)} recent releases")
         return {"status": "ok", "releases": releases}
     except Exception as e:
@@ -717,20 +1049,38 @@ def fetch_centcom_rss():
         return {"status": "error", "error": str(e), "releases": []}
 
 
+_USNI_TRACKER_URL_RE = re.compile(r'href="(https://news\.usni\.org/\d{4}/\d{2}/\d{2}/usni-news-fleet-and-marine-tracker[^"]*)"')
+_USNI_TRACKER_URL_LOOSE_RE = re.compile(r'href="(https://news\.usni\.org/\d{4}/\d{2}/\d{2}/[^"]*fleet[^"]*tracker[^"]*)"', re.I)
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+# One alternation, so the article is scanned once; the group name says which form matched and
+# results are listed form by form (hull numbers, then named groups, then CSG numbers) as before
+_CARRIER_RE = re.compile(
+    r'(?P<hull>USS\s+([\w\s]+?)\s*\(CVN[- ]?\d+\))'
+    r'|(?P<named>(Nimitz|Eisenhower|Lincoln|Truman|Reagan|Stennis|Vinson|Roosevelt|Washington|Bush|Ford|Enterprise)\s+(?:Carrier\s+)?Strike\s+Group)'
+    r'|(?P<csg>CSG[- ]?\d+)', re.I)
+_CARRIER_FORM_ORDER = {"hull": 0, "named": 1, "csg": 2}
+_ARTICLE_DATE_RE = re.compile(r'(\w+ \d{1,2}, \d{4})')
+
 def fetch_naval():
     """Fetch carrier strike group positions from USNI News Fleet Tracker."""
     print("[Naval] Fetching USNI Fleet Tracker...")
     try:
-        resp = requests.get("https://news.usni.org/category/fleet-tracker",
-            headers={"User-Agent": "IranWatch/2.0"}, timeout=15)
-        if resp.status_code != 200:
+        # The tracker is posted about weekly, so both GETs are conditional: an unchanged index
+        # yields last run's article URL, an unchanged article last run's parsed result
+        index_url = "https://news.usni.org/category/fleet-tracker"
+        index_cache, art_cache = _load_http_cache("usni_index"), _load_http_cache("usni_article")
+        resp = SESSION.get(index_url, headers=_conditional_headers(index_cache, index_url), timeout=15)
+        if resp.status_code == 304:
+            article_urls = [index_cache["payload"]]
+        elif resp.status_code != 200:
             print(f"[Naval] USNI returned {resp.status_code}")
             return {"status": "error", "error": f"HTTP {resp.status_code}", "carriers": []}
-
-        # Extract the most recent fleet tracker article URL
-        article_urls = re.findall(r'href="(https://news\.usni\.org/\d{4}/\d{2}/\d{2}/usni-news-fleet-and-marine-tracker[^"]*)"', resp.text)
-        if not article_urls:
-            article_urls = re.findall(r'href="(https://news\.usni\.org/\d{4}/\d{2}/\d{2}/[^"]*fleet[^"]*tracker[^"]*)"', resp.text, re.I)
+        else:
+            # Extract the most recent fleet tracker article URL
+            article_urls = _USNI_TRACKER_URL_RE.findall(resp.text)
+            if not article_urls:
+                article_urls = _USNI_TRACKER_URL_LOOSE_RE.findall(resp.text)
+            if article_urls: _save_http_cache("usni_index", index_url, resp, article_urls[0])
 
         if not article_urls:
             print("[Naval] No fleet tracker article found")
@@ -740,44 +1090,43 @@ def fetch_naval():
         # Fetch the most recent article
         article_url = article_urls[0]
         print(f"[Naval] Fetching article: {article_url}")
-        art_resp = requests.get(article_url, headers={"User-Agent": "IranWatch/2.0"}, timeout=15)
+        art_resp = SESSION.get(article_url, headers=_conditional_headers(art_cache, article_url), timeout=15)
+        if art_resp.status_code == 304:
+            print(f"[Naval] Article not modified; reusing {len(art_cache['payload']['carriers'])} cached carrier references")
+            return art_cache["payload"]
 
         if art_resp.status_code != 200:
             return {"status": "partial", "error": f"Article HTTP {art_resp.status_code}", "carriers": []}
 
         # Extract text content (strip HTML)
-        text = re.sub(r'<[^>]+>', ' ', art_resp.text)
-        text = re.sub(r'\s+', ' ', text)
+        text = " ".join(_HTML_TAG_RE.sub(' ', art_resp.text).split())
 
         # Look for carrier group mentions
-        carriers = []
-        carrier_patterns = [
-            r'USS\s+([\w\s]+?)\s*\(CVN[- ]?\d+\)',
-            r'(Nimitz|Eisenhower|Lincoln|Truman|Reagan|Stennis|Vinson|Roosevelt|Washington|Bush|Ford|Enterprise)\s+(?:Carrier\s+)?Strike\s+Group',
-            r'CSG[- ]?\d+',
-        ]
-        for pat in carrier_patterns:
-            for match in re.finditer(pat, text, re.I):
-                name = match.group(0).strip()
-                if name not in [c["name"] for c in carriers]:
-                    # Try to find location context (100 chars around the match)
-                    start = max(0, match.start() - 200)
-                    end = min(len(text), match.end() + 200)
-                    context = text[start:end]
-                    carriers.append({"name": name, "context": context[:300]})
+        carriers, seen_names = [], set()
+        for match in sorted(_CARRIER_RE.finditer(text), key=lambda m: _CARRIER_FORM_ORDER[m.lastgroup]):
+            name = match.group(0).strip()
+            if name in seen_names: continue
+            seen_names.add(name)
+            # Location context: from 200 chars before the match, at most 300 chars, in one slice
+            start = max(0, match.start() - 200)
+            end = min(match.end() + 200, start + 300)
+            carriers.append({"name": name, "context": text[start:end]})
+            if len(carriers) == 8: break  # only the first 8 are reported
 
         # Extract the date from the article
-        date_match = re.search(r'(\w+ \d{1,2}, \d{4})', text[:500])
+        date_match = _ARTICLE_DATE_RE.search(text[:500])
         article_date = date_match.group(1) if date_match else "Unknown date"
 
         print(f"[Naval] Found {len(carriers)} carrier references, article date: {article_date}")
-        return {
+        result = {
             "status": "ok",
             "article_url": article_url,
             "article_date": article_date,
             "carriers": carriers[:8],
             "raw_text": text[:3000],  # First 3000 chars for Claude to analyze
         }
+        _save_http_cache("usni_article", article_url, art_resp, result)
+        return result
     except Exception as e:
         print(f"[Naval] Error: {e}")
         return {"status": "error", "error": str(e), "carriers": []}
@@ -789,7 +1138,7 @@ def fetch_diplomatic_context():
     if not ANTHROPIC_API_KEY:
         return {"status": "no_api_key", "context": ""}
     try:
-        resp = requests.post("https://api.anthropic.com/v1/messages",
+        resp = SESSION.post("https://api.anthropic.com/v1/messages",
             headers={"x-api-key": ANTHROPIC_API_KEY, "content-type": "application/json",
                      "anthropic-version": "2023-06-01"},
             json={
@@ -819,13 +1168,82 @@ Provide a concise 3-5 bullet point summary of the most important diplomatic and
 # CLAUDE ANALYSIS
 # ──────────────────────────────────────────────────────────────
 
-def generate_analysis(aircraft, polymarket, metaculus, centcom, naval, diplomatic, kalshi, ac_baseline, market_trends):
+def _analysis_fingerprint(aircraft, markets, metaculus, centcom, naval):
+    """Hash of the inputs that drive the briefing; an unchanged hash means the last analysis still holds."""
+    key = {
+        "mil": sorted(a.get("callsign") or a.get("hex", "") for a in aircraft.get("mil_aircraft", [])),
+        "markets": sorted(((m.get("question", ""), m.get("probability")) for m in markets), key=str),
+        "metaculus": sorted(((q.get("question", ""), q.get("probability")) for q in metaculus.get("questions", [])), key=str),
+        "centcom": centcom.get("releases", []),
+        "naval": sorted(c["name"] for c in naval.get("carriers", [])),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _fmt_delta(d):
+    return f"{d:+g}" if d is not None else "n/a"
+
+def _prompt_lines(aircraft, markets, questions, carriers, releases):
+    """One line per item instead of JSON dumps — the model reads these just as well at a fraction of the tokens."""
+    ac_lines = []
+    for a in aircraft:
+        alt = f"{a['alt_ft']:,}ft" if a.get("alt_ft") is not None else "alt n/a"
+        ac_lines.append(f"- {a.get('callsign') or a.get('registration') or a.get('hex', '?')} [{a.get('status', 'new')}] "
+                        f"{a.get('airframe', '')} ({a.get('role', '')}) @ {a.get('location_desc', '')}, {alt} | "
+                        f"{a.get('origin') or '?'} type={a.get('aircraft_type') or '-'} reg={a.get('registration') or '-'} hex={a.get('hex') or '-'}")
+    mkt_lines = [f"- [{m.get('source', '')}/{m.get('category', '')}] {m.get('question', '')}: {m.get('probability')}% "
+                 f"(24h {_fmt_delta(m.get('delta_24h'))}, 7d {_fmt_delta(m.get('delta_7d'))}, vol ${float(m.get('volume', 0)):,.0f})"
+                 for m in markets]
+    mkt_lines += [f"- [metaculus] {q.get('question', '')}: {q.get('probability')}% ({q.get('forecasters', '?')} forecasters)"
+                  for q in questions]
+    carrier_lines = [f"- {c['name']}: {c.get('context', '')}" for c in carriers]
+    release_lines = [f"- {r}" for r in releases]
+    return tuple("\n".join(lines) for lines in (ac_lines, mkt_lines, carrier_lines, release_lines))
+
+
+_FENCED_JSON_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+
+def _extract_json(text):
+    """First JSON object in a model reply: a fenced block if there is one, else decoded from the first '{'
+    (raw_decode stops at the object's end, so trailing prose with braces doesn't break it)."""
+    m = _FENCED_JSON_RE.search(text)
+    if m:
+        try:
+            return json.loads(m.group(1))
+        except ValueError:
+            pass
+    start = text.find("{")
+    if start < 0: return None
+    try:
+        return json.JSONDecoder().raw_decode(text, start)[0]
+    except ValueError:
+        return None
+
+
+def _read_claude_stream(resp, deadline=None):
+    """Accumulate text deltas from a streamed Messages response (SSE). The read timeout
+    applies per chunk, so a stalled stream fails fast; deadline (monotonic) bounds a slow trickle."""
+    parts = []
+    with resp:
+        for line in resp.iter_lines(decode_unicode=True):
+            if deadline and time.monotonic() > deadline:
+                raise TimeoutError(f"analysis not complete after {ANALYSIS_TIMEOUT_S}s")
+            if not line or not line.startswith("data:"): continue
+            event = json.loads(line[5:])
+            if event.get("type") == "content_block_delta":
+                parts.append(event.get("delta", {}).get("text", ""))
+            elif event.get("type") == "error":
+                raise RuntimeError(event.get("error", {}).get("message", "stream error"))
+    return "".join(parts)
+
+
+def generate_analysis(aircraft, polymarket, metaculus, centcom, naval, diplomatic, kalshi, ac_baseline, market_trends, now=None):
     """Send all collected data to Claude for IC-style analysis."""
     print("[Claude] Generating analysis...")
     if not ANTHROPIC_API_KEY:
-        return generate_fallback_analysis(aircraft, polymarket, metaculus, centcom)
+        return generate_fallback_analysis(aircraft, polymarket, metaculus, centcom, ac_baseline)
 
-    now_utc = datetime.now(timezone.utc)
+    now_utc = now or datetime.now(timezone.utc)
     date_str = now_utc.strftime("%A, %d %B %Y")
 
     # Merge all prediction markets for the data summary
@@ -836,7 +1254,21 @@ def generate_analysis(aircraft, polymarket, metaculus, centcom, naval, diplomati
             m["delta_24h"] = market_trends[q].get("delta_24h")
             m["delta_7d"] = market_trends[q].get("delta_7d")
 
-    data_summary = f"""
+    # Nothing material changed since a recent run → reuse its analysis instead of paying for another call.
+    # Capped in age because the diplomatic context isn't part of the fingerprint.
+    fingerprint = _analysis_fingerprint(aircraft, all_markets, metaculus, centcom, naval)
+    cached = _load_http_cache("analysis")
+    if cached.get("fingerprint") == fingerprint and time.time() - cached.get("fetched_at", 0) < ANALYSIS_REUSE_HOURS * 3600:
+        print("[Claude] Inputs unchanged since last analysis; reusing it")
+        return cached["payload"]
+
+    ac_text, markets_text, carriers_text, releases_text = _prompt_lines(
+        aircraft.get("mil_aircraft", [])[:20], all_markets, metaculus.get("questions", []),
+        naval.get("carriers", []), centcom.get("releases", []))
+
+    # Detail blocks are left out when their source came back empty or failed — the status lines
+    # already tell the model that, and every omitted line is input it doesn't have to read
+    sections = [f"""
 ## LIVE DATA COLLECTED AT {now_utc.strftime('%Y-%m-%d %H:%M UTC')}
 
 ### Aircraft Tracking (airplanes.live, bounding box lat 10-55°N, lon 10°W-70°E)
@@ -844,28 +1276,31 @@ Source: {aircraft.get('source', 'airplanes.live')}
 Status: {aircraft['status']}
 Military aircraft in region: {aircraft.get('mil_count', 0)}
 Global military broadcasting: {aircraft.get('total_aircraft', 'N/A')}
-7-day average aircraft count: {ac_baseline.get('avg_7d', 'N/A')} (max: {ac_baseline.get('max_7d', 'N/A')}, from {ac_baseline.get('samples', 0)} samples)
-Aircraft details: {json.dumps(aircraft.get('mil_aircraft', [])[:20], indent=2)}
-
+7-day average aircraft count: {ac_baseline.get('avg_7d', 'N/A')} (max: {ac_baseline.get('max_7d', 'N/A')}, from {ac_baseline.get('samples', 0)} samples)"""]
+    if ac_text:
+        sections.append(f"Aircraft details (callsign [new/returning] airframe (role) @ location, altitude | origin, type code, registration, hex):\n{ac_text}")
+    sections.append(f"""
 ### Prediction Markets (Polymarket + Kalshi + Metaculus)
 Polymarket status: {polymarket['status']} ({len(polymarket.get('markets', []))} markets)
 Kalshi status: {kalshi['status']} ({len(kalshi.get('markets', []))} markets)
-Metaculus status: {metaculus['status']} ({len(metaculus.get('questions', []))} questions)
-Market data (with 24h/7d changes where available): {json.dumps(all_markets + metaculus.get('questions', []), indent=2)}
-
+Metaculus status: {metaculus['status']} ({len(metaculus.get('questions', []))} questions)""")
+    if markets_text:
+        sections.append(f"Market data (with 24h/7d changes in points where available):\n{markets_text}")
+    sections.append(f"""
 ### Naval Forces (USNI Fleet Tracker)
-Status: {naval['status']}
-Article date: {naval.get('article_date', 'N/A')}
-Carrier references: {json.dumps(naval.get('carriers', []), indent=2)}
-Fleet tracker summary: {naval.get('raw_text', 'N/A')[:2000]}
-
+Status: {naval['status']}""")
+    if naval.get("article_date"): sections.append(f"Article date: {naval['article_date']}")
+    if carriers_text: sections.append(f"Carrier references:\n{carriers_text}")
+    if naval.get("raw_text"): sections.append(f"Fleet tracker summary: {naval['raw_text'][:2000]}")
+    sections.append(f"""
 ### CENTCOM RSS
-Status: {centcom['status']}
-Recent releases: {json.dumps(centcom.get('releases', []), indent=2)}
-
+Status: {centcom['status']}""")
+    if releases_text: sections.append(f"Recent releases:\n{releases_text}")
+    if diplomatic.get("context"):
+        sections.append(f"""
 ### Current Diplomatic Context (from web search)
-{diplomatic.get('context', 'Not available')}
-"""
+{diplomatic['context']}""")
+    data_summary = "\n".join(sections) + "\n"
 
     system_prompt = """You are an intelligence analyst producing a 6-hourly open-source intelligence (OSINT) briefing on US military posture toward Iran. Write in IC (Intelligence Community) style with confidence levels.
 
@@ -909,38 +1344,51 @@ Date: """ + date_str + """
 
 Aircraft data from airplanes.live (unfiltered ADS-B, military-tagged). Many aircraft fly without transponders — partial picture. Includes type codes, registrations, hex IDs."""
 
+    # One budget for the POST's retries and the stream: measured before the first attempt
+    deadline = time.monotonic() + ANALYSIS_TIMEOUT_S
     try:
-        resp = requests.post("https://api.anthropic.com/v1/messages",
+        resp = SESSION.post("https://api.anthropic.com/v1/messages",
             headers={"x-api-key": ANTHROPIC_API_KEY, "content-type": "application/json", "anthropic-version": "2023-06-01"},
             json={"model": "claude-haiku-4-5-20251001", "max_tokens": 4096, "system": system_prompt,
+                  "stream": True,
                   "messages": [{"role": "user", "content": f"Generate the briefing.\n\n{data_summary}"}]},
-            timeout=90)
+            stream=True, timeout=(10, 30))
+        if time.monotonic() > deadline:
+            resp.close()
+            raise TimeoutError(f"analysis not started within {ANALYSIS_TIMEOUT_S}s (retries)")
         resp.raise_for_status()
-        content = resp.json().get("content", [{}])[0].get("text", "")
-        # Parse JSON from response
-        json_match = re.search(r'\{[\s\S]*\}', content)
-        if json_match:
-            analysis = json.loads(json_match.group())
+        content = _read_claude_stream(resp, deadline=deadline)
+        analysis = _extract_json(content)
+        if analysis is not None:
             print("[Claude] Analysis generated successfully")
+            _write_http_cache("analysis", {"fingerprint": fingerprint, "fetched_at": time.time(), "payload": analysis})
             return analysis
     except Exception as e:
         print(f"[Claude] Error: {e}")
-    return generate_fallback_analysis(aircraft, polymarket, metaculus, centcom)
+    print("[Claude] Falling back to rule-based analysis")
+    return generate_fallback_analysis(aircraft, polymarket, metaculus, centcom, ac_baseline)
 
 
-def generate_fallback_analysis(aircraft, polymarket, metaculus, centcom):
+def generate_fallback_analysis(aircraft, polymarket, metaculus, centcom, ac_baseline=None):
     """Offline fallback when Claude API is unavailable."""
     mil_list = aircraft.get("mil_aircraft", [])
-    types = {}
-    for a in mil_list:
-        r = a.get("role", "Military")
-        types[r] = types.get(r, 0) + 1
-    ac_str = ", ".join(f"{v} {k}" for k, v in sorted(types.items(), key=lambda x: -x[1])[:4])
+    types = Counter(a.get("role", "Military") for a in mil_list)
+    ac_str = ", ".join(f"{v} {k}" for k, v in types.most_common(4))
     pm_markets = polymarket.get("markets", [])
     pm_summary = f"Tracking {len(pm_markets)} prediction markets." if pm_markets else "Prediction market data unavailable."
+    # Threat level from the numbers alone: the most bullish strike/conflict market, and aircraft
+    # against their 7-day average in the same bands as the baseline banner (no average, no signal)
+    strike_markets = [m for m in pm_markets if m.get("category") in ("us_strike", "israel_strike", "conflict")]
+    top = max(strike_markets, key=lambda m: m.get("probability") or 0, default=None)
+    top_prob = (top or {}).get("probability") or 0
+    if top: pm_summary += f" Highest: {top.get('question', '')} at {top_prob}%."
+    avg = (ac_baseline or {}).get("avg_7d")
+    ac_level = _BASELINE_LEVELS[bisect_left(_BASELINE_BANDS, aircraft.get("mil_count", 0) / avg)] if avg else None
+    threat_level = ("HIGH" if top_prob >= 60 or ac_level == "high" else
+                    "ELEVATED" if top_prob >= 25 or ac_level == "moderate" else "ROUTINE")
 
     return {
-        "threat_level": "ELEVATED",
+        "threat_level": threat_level,
         "threat_summary": f"Monitoring {aircraft.get('mil_count','unknown')} military aircraft in region. {ac_str}. {pm_summary}",
         "key_judgment": "Assessment generated without AI analysis — API unavailable. Data should be interpreted with caution.",
         "overnight_summary": f"Detected {aircraft.get('mil_count',0)} military aircraft broadcasting ADS-B. CENTCOM published {len(centcom.get('releases',[]))} releases.",
@@ -956,38 +1404,87 @@ def generate_fallback_analysis(aircraft, polymarket, metaculus, centcom):
 # HTML GENERATION
 # ──────────────────────────────────────────────────────────────
 
-def generate_html(analysis, aircraft, polymarket, metaculus, centcom, naval, kalshi, market_trends, ac_baseline, snapshots):
-    now = datetime.now(timezone.utc)
+# Palette shared with the template's :root variables
+_COL_RED = "#ef4444"
+_COL_AMBER = "#f59e0b"
+_COL_GREEN = "#22c55e"
+_COL_CYAN = "#06b6d4"
+_COL_MUTED = "#94a3b8"
+
+_CAT_BADGES = {
+    "us_strike": ("US STRIKE", _COL_RED), "israel_strike": ("ISRAEL STRIKE", _COL_AMBER),
+    "conflict": ("CONFLICT", _COL_AMBER), "nuclear": ("NUCLEAR", _COL_RED),
+    "ceasefire": ("DIPLOMATIC", _COL_CYAN),
+}
+
+# Simplified country outlines for the map, as [lat, lon] rings. Served as borders.json
+# so browsers cache them across updates instead of re-downloading them in index.html.
+MAP_BORDERS = {
+    "Iran": [
+        [25.1,61.6],[25.3,58.9],[26.3,56.3],[27.2,54.7],[26.5,53.4],[27.0,51.5],[29.8,50.3],[30.4,48.8],
+        [31.0,47.7],[32.3,47.4],[33.7,46.0],[35.1,45.4],[36.6,45.0],[37.4,44.8],[38.3,44.4],[39.4,44.0],
+        [39.8,47.8],[39.3,48.0],[38.9,48.9],[37.6,49.1],[37.3,50.1],[36.7,53.9],[37.4,55.4],[37.3,57.2],
+        [35.8,60.5],[34.5,60.9],[33.7,60.5],[31.3,61.7],[27.2,63.3],[25.1,61.6],
+    ],
+    "Iraq": [
+        [29.1,47.4],[30.4,47.0],[31.0,47.7],[32.3,47.4],[33.7,46.0],[35.1,45.4],[36.6,45.0],[37.4,44.8],
+        [37.1,42.4],[36.8,41.0],[33.4,40.9],[32.0,39.0],[30.0,40.0],[29.1,44.7],[29.1,47.4],
+    ],
+    "Saudi Arabia": [
+        [16.4,42.7],[17.5,43.4],[18.2,44.2],[19.0,45.0],[20.0,45.0],[21.5,49.0],[22.5,50.8],[24.0,52.0],
+        [24.2,51.6],[25.8,50.8],[27.0,49.6],[28.5,48.4],[29.1,47.4],[29.1,44.7],[28.0,37.0],[25.0,37.5],
+        [20.0,40.0],[17.8,42.0],[16.4,42.7],
+    ],
+}
+
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+# Probability moves: rising risk is red, falling is green
+_DELTA_STYLE = {True: ("↑", _COL_RED), False: ("↓", _COL_GREEN)}
+# Probability colour bands: <40 muted, 40–59 amber, ≥60 red
+_PROB_BANDS, _PROB_COLS = (40, 60), (_COL_MUTED, _COL_AMBER, _COL_RED)
+# Aircraft count vs 7-day average: >1.2× moderate alert, >1.5× high alert (bisect_left keeps the bounds exclusive)
+_BASELINE_BANDS, _BASELINE_LEVELS = (1.2, 1.5), (None, "moderate", "high")
+
+# Aircraft fields the map script reads, with defaults for missing ones
+_AC_MAP_FIELDS = (("callsign", ""), ("hex", ""), ("registration", ""), ("lat", None), ("lon", None),
+                  ("alt_ft", None), ("origin", ""), ("status", "new"), ("location_desc", ""),
+                  ("airframe", ""), ("role", ""))
+_AC_MAP_EMPTY = json.dumps({"k": [k for k, _ in _AC_MAP_FIELDS], "r": []}, separators=(",", ":"))
+
+def _json_for_js(obj):
+    """Serialise obj for embedding in a single-quoted JS string passed to JSON.parse."""
+    js = json.dumps(obj, separators=(",", ":"))
+    return js.replace("\\", "\\\\").replace("'", "\\'").replace("<", "\\u003c")
+
+def _coerce_claude_str(val):
+    """Claude sometimes returns lists where prose was asked for — join them as lines."""
+    if isinstance(val, str): return val
+    if isinstance(val, list): return "<br>".join(map(str, val))
+    return str(val) if val else ""
+
+def generate_html(analysis, aircraft, polymarket, metaculus, centcom, naval, kalshi, market_trends, ac_baseline, snapshots, now=None):
+    now = now or datetime.now(timezone.utc)
     date_str = now.strftime("%d %B %Y")
     time_str = now.strftime("%H:%M UTC")
     threat_level = analysis.get("threat_level", "ELEVATED")
     tl = threat_level.lower()
 
-    def s(val):
-        if isinstance(val, list): return "<br>".join(str(i) for i in val)
-        return str(val) if val else ""
-
     # Build activity groups HTML
-    groups_html = ""
-    for g in analysis.get("activity_groups", []):
-        icon = g.get("icon", "routine")
-        groups_html += f'<div class="ag"><div class="ag-dot {icon}"></div><div><div class="ag-t">{g["title"]}</div><div class="ag-b">{g["body"]}</div></div></div>'
+    groups_html = "".join(
+        f'<div class="ag"><div class="ag-dot {g.get("icon", "routine")}"></div><div><div class="ag-t">{g["title"]}</div><div class="ag-b">{g["body"]}</div></div></div>'
+        for g in analysis.get("activity_groups", []))
 
     # Build all markets (Polymarket + Kalshi + Metaculus)
     all_pm = polymarket.get("markets", []) + kalshi.get("markets", [])
-    markets_html = ""
-    cat_badges = {
-        "us_strike": ("US STRIKE", "#ef4444"), "israel_strike": ("ISRAEL STRIKE", "#f59e0b"),
-        "conflict": ("CONFLICT", "#f59e0b"), "nuclear": ("NUCLEAR", "#ef4444"),
-        "ceasefire": ("DIPLOMATIC", "#06b6d4"),
-    }
+    market_parts = []
     for m in all_pm:
         prob = m["probability"]
-        col = "#ef4444" if prob >= 60 else "#f59e0b" if prob >= 40 else "#94a3b8"
+        col = _PROB_COLS[bisect_right(_PROB_BANDS, prob)]
         vol = float(m.get("volume", 0))
         vol_str = f"${vol/1e6:.1f}M" if vol >= 1e6 else f"${vol/1e3:.0f}K" if vol >= 1e3 else f"${vol:.0f}"
         cat = m.get("category", "other")
-        badge_label, badge_col = cat_badges.get(cat, ("", "#94a3b8"))
+        badge_label, badge_col = _CAT_BADGES.get(cat, ("", _COL_MUTED))
         badge_html = f'<span class="cat-badge" style="--c:{badge_col}">{badge_label}</span>' if badge_label else ""
         src_label = m.get("source", "polymarket").capitalize()
         # Delta
@@ -996,47 +1493,48 @@ def generate_html(analysis, aircraft, polymarket, metaculus, centcom, naval, kal
         delta_24h = trend.get("delta_24h") or m.get("delta_24h")
         delta_7d = trend.get("delta_7d") or m.get("delta_7d")
         delta_html = ""
-        if delta_24h is not None and delta_24h != 0:
-            arrow = "↑" if delta_24h > 0 else "↓"
-            dcol = "#ef4444" if delta_24h > 0 else "#22c55e"
-            weight = "700" if abs(delta_24h) >= 5 else "400"
-            delta_html += f'<span class="delta" style="color:{dcol};font-weight:{weight}">{arrow}{abs(delta_24h)}pts 24h</span>'
-        if delta_7d is not None and delta_7d != 0:
-            arrow = "↑" if delta_7d > 0 else "↓"
-            dcol = "#ef4444" if delta_7d > 0 else "#22c55e"
+        if delta_24h:
+            arrow, dcol = _DELTA_STYLE[delta_24h > 0]
+            ad = abs(delta_24h)
+            weight = "700" if ad >= 5 else "400"
+            delta_html += f'<span class="delta" style="color:{dcol};font-weight:{weight}">{arrow}{ad}pts 24h</span>'
+        if delta_7d:
+            arrow, dcol = _DELTA_STYLE[delta_7d > 0]
             delta_html += f'<span class="delta" style="color:{dcol}">{arrow}{abs(delta_7d)}pts 7d</span>'
 
         url = m.get("url", "#")
-        markets_html += f'''<div class="mkt">
-          <div class="mkt-info">{badge_html}<a href="{url}" target="_blank" class="mkt-q">{m["question"]}</a><div class="mkt-meta">{src_label} · Vol: {vol_str}</div></div>
-          <div class="mkt-right"><div class="mkt-prob" style="color:{col}">{prob}%</div>{delta_html}</div></div>'''
+        market_parts.append(f'''<div class="mkt">
+          <div class="mkt-info">{badge_html}<a href="{escape(url)}" target="_blank" class="mkt-q">{escape(m["question"])}</a><div class="mkt-meta">{src_label} · Vol: {vol_str}</div></div>
+          <div class="mkt-right"><div class="mkt-prob" style="color:{col}">{prob}%</div>{delta_html}</div></div>''')
 
     # Metaculus
     for q in metaculus.get("questions", []):
         prob = q["probability"]
-        col = "#ef4444" if prob >= 60 else "#f59e0b" if prob >= 40 else "#94a3b8"
+        col = _PROB_COLS[bisect_right(_PROB_BANDS, prob)]
         url = q.get("url", "#")
-        markets_html += f'''<div class="mkt">
-          <div class="mkt-info"><a href="{url}" target="_blank" class="mkt-q">{q["question"]}</a><div class="mkt-meta">Metaculus · {q.get("forecasters","?")} forecasters</div></div>
-          <div class="mkt-right"><div class="mkt-prob" style="color:{col}">{prob}%</div></div></div>'''
+        market_parts.append(f'''<div class="mkt">
+          <div class="mkt-info"><a href="{escape(url)}" target="_blank" class="mkt-q">{escape(q["question"])}</a><div class="mkt-meta">Metaculus · {q.get("forecasters","?")} forecasters</div></div>
+          <div class="mkt-right"><div class="mkt-prob" style="color:{col}">{prob}%</div></div></div>''')
 
-    if not markets_html:
-        markets_html = '<div class="mkt"><div class="mkt-info mkt-q" style="color:#64748b">No prediction market data available.</div></div>'
+    markets_html = "".join(market_parts) or (
+        '<div class="mkt"><div class="mkt-info mkt-q" style="color:#64748b">No prediction market data available.</div></div>')
 
     # Aircraft table
-    mil_html = ""
-    for a in aircraft.get("mil_aircraft", [])[:25]:
+    mil_list = aircraft.get("mil_aircraft", [])
+    mil_parts = []
+    for a in mil_list[:25]:
         label = a.get("callsign") or a.get("registration") or a.get("hex", "?")
         status_cls = "new" if a.get("status") == "new" else ""
-        mil_html += f'<tr class="{status_cls}"><td class="ac-label">{label}</td><td>{a["airframe"]}</td><td class="ac-role">{a["role"]}</td><td>{a["location_desc"]}</td><td class="ac-alt">{a["alt_ft"]:,} ft</td></tr>' if a.get("alt_ft") else f'<tr class="{status_cls}"><td class="ac-label">{label}</td><td>{a["airframe"]}</td><td class="ac-role">{a["role"]}</td><td>{a["location_desc"]}</td><td class="ac-alt">—</td></tr>'
+        alt = f'{a["alt_ft"]:,} ft' if a.get("alt_ft") else "—"
+        mil_parts.append(f'<tr class="{status_cls}"><td class="ac-label">{escape(label)}</td><td>{escape(a["airframe"])}</td><td class="ac-role">{escape(a["role"])}</td><td>{escape(a["location_desc"])}</td><td class="ac-alt">{alt}</td></tr>')
+    mil_html = "".join(mil_parts)
 
     # CENTCOM
-    centcom_html = ""
-    for r in centcom.get("releases", [])[:8]:
-        centcom_html += f'<div class="centcom-item">{r}</div>'
+    # Titles come both raw (CDATA) and entity-encoded (plain <title>); normalise before escaping
+    centcom_html = "".join(f'<div class="centcom-item">{escape(unescape(r))}</div>' for r in centcom.get("releases", [])[:8])
 
     # Naval
-    naval_html = s(analysis.get("naval_summary", ""))
+    naval_html = _coerce_claude_str(analysis.get("naval_summary", ""))
     naval_carriers = naval.get("carriers", [])
     naval_date = naval.get("article_date", "")
 
@@ -1047,15 +1545,22 @@ def generate_html(analysis, aircraft, polymarket, metaculus, centcom, naval, kal
     baseline_html = ""
     if avg and avg > 0:
         ratio = current_count / avg
-        if ratio > 1.5:
-            baseline_html = f'<span class="baseline-alert high">{current_count} aircraft — {ratio:.1f}× above 7-day average ({avg})</span>'
-        elif ratio > 1.2:
-            baseline_html = f'<span class="baseline-alert moderate">{current_count} aircraft — {ratio:.1f}× above 7-day average ({avg})</span>'
+        level = _BASELINE_LEVELS[bisect_left(_BASELINE_BANDS, ratio)]
+        if level:
+            baseline_html = f'<span class="baseline-alert {level}">{current_count} aircraft — {ratio:.1f}× above 7-day average ({avg})</span>'
         else:
             baseline_html = f'<span class="baseline-normal">{current_count} aircraft (7-day avg: {avg})</span>'
     else:
         baseline_html = f'<span class="baseline-normal">{current_count} military aircraft detected</span>'
 
+    # Map payload as field names once plus one row per aircraft — no repeated keys per object.
+    # Quiet days have no aircraft, so skip the projection entirely
+    if mil_list:
+        aircraft_json = _json_for_js({"k": [k for k, _ in _AC_MAP_FIELDS],
+                                      "r": [[a.get(k, d) for k, d in _AC_MAP_FIELDS] for a in mil_list]})
+    else:
+        aircraft_json = _AC_MAP_EMPTY
+
     # API status
     feeds = [
         ("airplanes.live", aircraft["status"]),
@@ -1065,53 +1570,63 @@ def generate_html(analysis, aircraft, polymarket, metaculus, centcom, naval, kal
         ("USNI Naval", naval["status"]),
         ("CENTCOM", centcom["status"]),
     ]
-    feeds_html = ""
-    for name, st in feeds:
-        dot = "ok" if st == "ok" else "err"
-        feeds_html += f'<span class="feed"><span class="fd {dot}"></span>{name}</span>'
+    feeds_html = "".join(
+        f'<span class="feed"><span class="fd {"ok" if st == "ok" else "err"}"></span>{name}</span>'
+        for name, st in feeds)
 
     # Inject into template
-    html = HTML_TEMPLATE
     replacements = {
-        "{{DATE}}": date_str, "{{TIME}}": time_str,
-        "{{THREAT_LEVEL}}": threat_level, "{{TL}}": tl,
-        "{{THREAT_SUMMARY}}": s(analysis.get("threat_summary", "")),
-        "{{KEY_JUDGMENT}}": s(analysis.get("key_judgment", "")),
-        "{{OVERNIGHT}}": s(analysis.get("overnight_summary", "")),
-        "{{GROUPS}}": groups_html,
-        "{{MARKETS_HTML}}": markets_html,
-        "{{MARKETS_SUMMARY}}": s(analysis.get("prediction_markets_summary", "")),
-        "{{NAVAL_SUMMARY}}": naval_html,
-        "{{NAVAL_DATE}}": naval_date,
-        "{{DIPLOMATIC}}": s(analysis.get("diplomatic_summary", "")),
-        "{{IW}}": s(analysis.get("iw_updates", "")),
-        "{{MIL_HTML}}": mil_html,
-        "{{MIL_COUNT}}": str(aircraft.get("mil_count", 0)),
-        "{{BASELINE}}": baseline_html,
-        "{{CENTCOM_HTML}}": centcom_html,
-        "{{FEEDS}}": feeds_html,
-        "{{AIRCRAFT_JSON}}": json.dumps([{
-            "callsign": a.get("callsign",""), "hex": a.get("hex",""), "registration": a.get("registration",""),
-            "lat": a.get("lat"), "lon": a.get("lon"), "alt_ft": a.get("alt_ft"),
-            "origin": a.get("origin",""), "status": a.get("status","new"),
-            "location_desc": a.get("location_desc",""), "airframe": a.get("airframe",""), "role": a.get("role",""),
-        } for a in aircraft.get("mil_aircraft", [])]),
+        "DATE": date_str, "TIME": time_str, "CSS_FILE": CSS_FILE,
+        "THREAT_LEVEL": threat_level, "TL": tl,
+        "THREAT_SUMMARY": _coerce_claude_str(analysis.get("threat_summary", "")),
+        "KEY_JUDGMENT": _coerce_claude_str(analysis.get("key_judgment", "")),
+        "OVERNIGHT": _coerce_claude_str(analysis.get("overnight_summary", "")),
+        "GROUPS": groups_html,
+        "MARKETS_HTML": markets_html,
+        "MARKETS_SUMMARY": _coerce_claude_str(analysis.get("prediction_markets_summary", "")),
+        "NAVAL_SUMMARY": naval_html,
+        "NAVAL_DATE": naval_date,
+        "DIPLOMATIC": _coerce_claude_str(analysis.get("diplomatic_summary", "")),
+        "IW": _coerce_claude_str(analysis.get("iw_updates", "")),
+        "MIL_HTML": mil_html,
+        "MIL_COUNT": str(aircraft.get("mil_count", 0)),
+        "BASELINE": baseline_html,
+        "CENTCOM_HTML": centcom_html,
+        "FEEDS": feeds_html,
+        "AIRCRAFT_JSON": aircraft_json,
     }
-    for k, v in replacements.items():
-        html = html.replace(k, v)
-    return html
+    # One pass over the template; substituted values are never rescanned
+    return _PLACEHOLDER_RE.sub(lambda m: replacements.get(m.group(1), m.group(0)), HTML_TEMPLATE)
+
+
+def write_static_assets(output_dir):
+    """Write borders.json and the hashed stylesheet beside index.html, touching them only when they change."""
+    css_fp = os.path.join(output_dir, CSS_FILE)
+    if not os.path.exists(css_fp):
+        for stale in glob.glob(os.path.join(output_dir, "iw.*.css")):
+            os.remove(stale)
+        with open(css_fp, "w", encoding="utf-8") as f:
+            f.write(PAGE_CSS)
+        print(f"[HTML] Wrote {css_fp}")
+    fp = os.path.join(output_dir, "borders.json")
+    data = json.dumps(MAP_BORDERS, separators=(",", ":"))
+    try:
+        with open(fp, encoding="utf-8") as f:
+            if f.read() == data: return
+    except OSError:
+        pass
+    with open(fp, "w", encoding="utf-8") as f:
+        f.write(data)
+    print(f"[HTML] Wrote {fp}")
 
 
 # ──────────────────────────────────────────────────────────────
 # HTML TEMPLATE
 # ──────────────────────────────────────────────────────────────
 
-HTML_TEMPLATE = r"""<!DOCTYPE html>
-<html lang="en"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width,initial-scale=1">
-<title>IRAN WATCH</title>
-<link href="https://fonts.googleapis.com/css2?family=DM+Sans:ital,opsz,wght@0,9..40,300;0,9..40,400;0,9..40,500;0,9..40,600;0,9..40,700;1,9..40,400&family=JetBrains+Mono:wght@400;500;600;700&family=Newsreader:ital,opsz,wght@0,6..72,400;0,6..72,500;1,6..72,400&display=swap" rel="stylesheet">
-<style>
-*{margin:0;padding:0;box-sizing:border-box}
+# Page styles, served as a content-hashed file: identical across updates, so browsers keep it cached
+# and index.html no longer re-ships it every 6 hours. The name changes whenever the CSS does.
+PAGE_CSS = r"""*{margin:0;padding:0;box-sizing:border-box}
 :root{--bg:#080a0f;--bg2:#0c0f16;--bg3:#111520;--bg4:#171c28;--border:#1a2035;--border2:#242d45;--text:#e2e8f0;--text2:#94a3b8;--text3:#64748b;--text4:#475569;--red:#ef4444;--amber:#f59e0b;--green:#22c55e;--blue:#3b82f6;--cyan:#06b6d4;--red-bg:rgba(239,68,68,.08);--amber-bg:rgba(245,158,11,.08);--green-bg:rgba(34,197,94,.08);--blue-bg:rgba(59,130,246,.08)}
 body{background:var(--bg);color:var(--text);font-family:'DM Sans',system-ui,sans-serif;font-size:15px;line-height:1.65;-webkit-font-smoothing:antialiased}
 a{color:var(--cyan);text-decoration:none}a:hover{text-decoration:underline}
@@ -1175,7 +1690,7 @@ a{color:var(--cyan);text-decoration:none}a:hover{text-decoration:underline}
 .fd{width:6px;height:6px;border-radius:50%}.fd.ok{background:var(--green)}.fd.err{background:var(--red)}
 .foot{border-top:1px solid var(--border);padding:20px 0;margin-top:40px;font-family:'JetBrains Mono',monospace;font-size:10px;color:var(--text4);text-align:center;line-height:2}
 .map-wrap{position:relative;width:100%;height:420px;background:var(--bg);border-radius:0;overflow:hidden}
-.map-wrap canvas{width:100%;height:100%}
+.map-wrap canvas{position:absolute;inset:0;width:100%;height:100%}
 #tooltip{position:absolute;background:var(--bg4);border:1px solid var(--border2);border-radius:6px;padding:12px 16px;font-family:'JetBrains Mono',monospace;font-size:11px;pointer-events:none;opacity:0;transition:opacity .15s;z-index:10;max-width:240px;box-shadow:0 8px 32px rgba(0,0,0,.5)}
 .map-note{font-size:11px;color:var(--text4);padding:8px 12px;text-align:center}
 @media(max-width:768px){.grid2{grid-template-columns:1fr}.hdr-inner{padding:12px 16px}.main{padding:16px 16px 80px}.threat{flex-direction:column;gap:12px}.brand-text{font-size:14px;letter-spacing:3px}.mkt{flex-direction:column;align-items:flex-start;gap:8px}.mkt-right{text-align:left;display:flex;align-items:center;gap:12px}.mkt-prob{font-size:18px}.map-wrap{height:280px}.ac-table{font-size:12px}.judgment{font-size:15px;padding:16px}.sec{font-size:10px}}
@@ -1195,7 +1710,15 @@ a{color:var(--cyan);text-decoration:none}a:hover{text-decoration:underline}
 .src-grid{display:grid;grid-template-columns:1fr 1fr;gap:8px;margin:14px 0}
 .src-item{background:var(--bg4);border-radius:5px;padding:8px 12px;font-family:'JetBrains Mono',monospace;font-size:11px}
 .src-item .src-name{color:var(--cyan);font-weight:600}.src-item .src-desc{color:var(--text4);font-size:10px;margin-top:2px}
-</style></head><body>
+"""
+CSS_FILE = f"iw.{hashlib.sha256(PAGE_CSS.encode()).hexdigest()[:8]}.css"
+
+HTML_TEMPLATE = r"""<!DOCTYPE html>
+<html lang="en"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width,initial-scale=1">
+<title>IRAN WATCH</title>
+<link href="https://fonts.googleapis.com/css2?family=DM+Sans:ital,opsz,wght@0,9..40,300;0,9..40,400;0,9..40,500;0,9..40,600;0,9..40,700;1,9..40,400&family=JetBrains+Mono:wght@400;500;600;700&family=Newsreader:ital,opsz,wght@0,6..72,400;0,6..72,500;1,6..72,400&display=swap" rel="stylesheet">
+<link rel="stylesheet" href="{{CSS_FILE}}">
+</head><body>
 <div class="hdr"><div class="hdr-inner"><div class="brand"><div class="pulse"></div><div class="brand-text">Iran Watch</div></div><div style="display:flex;align-items:center;gap:14px"><button class="how-btn" onclick="document.getElementById('howModal').classList.add('open')">How it works</button><div class="hdr-right"><strong>{{DATE}}</strong>Updated {{TIME}} &middot; 6-hour cycle</div></div></div></div>
 <div class="modal-bg" id="howModal" onclick="if(event.target===this)this.classList.remove('open')"><div class="modal"><div class="modal-top"><div class="modal-t">How Iran Watch Works</div><button class="modal-x" onclick="document.getElementById('howModal').classList.remove('open')">&times;</button></div><div class="modal-body"><p><strong>Iran Watch</strong> is an automated open-source intelligence (OSINT) monitor that tracks US military posture toward Iran. It updates every 6 hours via GitHub Actions.</p><p>A Python script queries 7 free data sources, then sends the collected data to Claude (Anthropic's AI) for IC-style analysis with confidence levels and threat assessments.</p><div class="src-grid"><div class="src-item"><div class="src-name">airplanes.live</div><div class="src-desc">Military aircraft via ADS-B</div></div><div class="src-item"><div class="src-name">Polymarket</div><div class="src-desc">Prediction market prices</div></div><div class="src-item"><div class="src-name">Kalshi</div><div class="src-desc">Regulated prediction markets</div></div><div class="src-item"><div class="src-name">Metaculus</div><div class="src-desc">Community forecasting</div></div><div class="src-item"><div class="src-name">USNI News</div><div class="src-desc">Carrier strike group tracker</div></div><div class="src-item"><div class="src-name">CENTCOM</div><div class="src-desc">Press releases &amp; statements</div></div><div class="src-item"><div class="src-name">Claude Search</div><div class="src-desc">Diplomatic context via web</div></div><div class="src-item"><div class="src-name">History</div><div class="src-desc">7-day rolling baseline</div></div></div><p>The analytical framework draws on Cynthia Grabo's <em style="color:var(--amber)">Anticipating Surprise</em> (DIA, 2002). Aircraft detection is partial — most military flights disable transponders. Prediction markets are shown with 24-hour and 7-day probability changes.</p><p style="color:var(--text4);font-size:12px">Built with Python, Claude Haiku 4.5, and GitHub Pages. Total cost ~$4-8/month.</p></div></div></div>
 <div class="main">
@@ -1213,7 +1736,7 @@ a{color:var(--cyan);text-decoration:none}a:hover{text-decoration:underline}
 <div class="sec"><span>Aircraft Detection</span><span class="tag tag-live">{{MIL_COUNT}} aircraft</span></div>
 <div class="card">
 <div class="card-hdr"><div class="card-title">Military Aircraft &mdash; ADS-B</div><div>{{BASELINE}}</div></div>
-<div class="map-wrap" id="mapWrap"><canvas id="mapCanvas"></canvas><div id="tooltip"></div></div>
+<div class="map-wrap" id="mapWrap"><canvas id="mapBg"></canvas><canvas id="mapCanvas"></canvas><div id="tooltip"></div></div>
 <div class="map-note">Bright = new &middot; Dim = still present &middot; Most military flights fly dark</div>
 <div class="ac-wrap"><table class="ac-table"><thead><tr><th>Callsign</th><th>Type</th><th>Role</th><th>Location</th><th style="text-align:right">Alt</th></tr></thead><tbody>{{MIL_HTML}}</tbody></table></div>
 </div>
@@ -1227,25 +1750,43 @@ a{color:var(--cyan);text-decoration:none}a:hover{text-decoration:underline}
 
 <script>
 (function(){
-const aircraft={{AIRCRAFT_JSON}};
-const bases=[{name:"Al Udeid AB",lat:25.117,lon:51.315},{name:"Al Dhafra AB",lat:24.248,lon:54.547},{name:"Ali Al Salem",lat:29.346,lon:47.521},{name:"Incirlik AB",lat:37.002,lon:35.426},{name:"RAF Akrotiri",lat:34.590,lon:32.988},{name:"Camp Lemonnier",lat:11.547,lon:43.155}];
-const borders={"Iran":[[25.1,61.6],[25.3,58.9],[26.3,56.3],[27.2,54.7],[26.5,53.4],[27.0,51.5],[29.8,50.3],[30.4,48.8],[31.0,47.7],[32.3,47.4],[33.7,46.0],[35.1,45.4],[36.6,45.0],[37.4,44.8],[38.3,44.4],[39.4,44.0],[39.8,47.8],[39.3,48.0],[38.9,48.9],[37.6,49.1],[37.3,50.1],[36.7,53.9],[37.4,55.4],[37.3,57.2],[35.8,60.5],[34.5,60.9],[33.7,60.5],[31.3,61.7],[27.2,63.3],[25.1,61.6]],"Iraq":[[29.1,47.4],[30.4,47.0],[31.0,47.7],[32.3,47.4],[33.7,46.0],[35.1,45.4],[36.6,45.0],[37.4,44.8],[37.1,42.4],[36.8,41.0],[33.4,40.9],[32.0,39.0],[30.0,40.0],[29.1,44.7],[29.1,47.4]],"Saudi Arabia":[[16.4,42.7],[17.5,43.4],[18.2,44.2],[19.0,45.0],[20.0,45.0],[21.5,49.0],[22.5,50.8],[24.0,52.0],[24.2,51.6],[25.8,50.8],[27.0,49.6],[28.5,48.4],[29.1,47.4],[29.1,44.7],[28.0,37.0],[25.0,37.5],[20.0,40.0],[17.8,42.0],[16.4,42.7]]};
+const acRows=JSON.parse('{{AIRCRAFT_JSON}}');const aircraft=acRows.r.map(r=>{const a={};acRows.k.forEach((k,i)=>a[k]=r[i]);return a});
+const bases=JSON.parse('[{"name":"Al Udeid AB","lat":25.117,"lon":51.315},{"name":"Al Dhafra AB","lat":24.248,"lon":54.547},{"name":"Ali Al Salem","lat":29.346,"lon":47.521},{"name":"Incirlik AB","lat":37.002,"lon":35.426},{"name":"RAF Akrotiri","lat":34.590,"lon":32.988},{"name":"Camp Lemonnier","lat":11.547,"lon":43.155}]');
 const labels=[[32,"IRAN",53],[33,"IRAQ",43.5],[24,"S. ARABIA",45],[35,"TURKEY",35],[15,"YEMEN",47]];
-const V={cLat:27,cLon:48,s:14};const wrap=document.getElementById('mapWrap');const canvas=document.getElementById('mapCanvas');const ctx=canvas.getContext('2d');const tip=document.getElementById('tooltip');
+const V={cLat:27,cLon:48,s:14};const wrap=document.getElementById('mapWrap');const bgCanvas=document.getElementById('mapBg');const bctx=bgCanvas.getContext('2d',{alpha:false});const canvas=document.getElementById('mapCanvas');const ctx=canvas.getContext('2d');const tip=document.getElementById('tooltip');
 let W,H;function tX(n){return(n-V.cLon)*V.s+W/2}function tY(t){return(V.cLat-t)*V.s+H/2}
-function getCat(cs){cs=(cs||'').toUpperCase();const c=[{p:['RCH','REACH','PACK','DUKE','MOOSE','FRED','CARGO','HERK'],t:'Airlift',c:'#ef4444'},{p:['ETHYL','JULIET','PEARL','STEEL','SHELL','TEAL','NKAC','PKSN','GOLD','BLUE','IRON'],t:'Tanker',c:'#3b82f6'},{p:['HOMER','TOPCT','JAKE','TITAN','FORTE','MAGIC','SNTRY','REDEYE','OLIVE','MAZDA'],t:'ISR/AWACS',c:'#f59e0b'},{p:['DOOM','DEATH','BATT','MYTEE','BONE','VIPER','EAGLE','RAZOR','HAWK','STRIKE','WRATH','BOLT','ASCOT','TABOR'],t:'Strike',c:'#22c55e'}];for(const g of c)for(const px of g.p)if(cs.startsWith(px))return g;return{t:'Military',c:'#94a3b8'}}
-function draw(){ctx.clearRect(0,0,W,H);ctx.fillStyle='#080a0f';ctx.fillRect(0,0,W,H);
-ctx.strokeStyle='rgba(26,32,53,.4)';ctx.lineWidth=.5;for(let lat=-10;lat<=60;lat+=5){ctx.beginPath();ctx.moveTo(tX(10),tY(lat));ctx.lineTo(tX(85),tY(lat));ctx.stroke()}for(let lon=10;lon<=85;lon+=5){ctx.beginPath();ctx.moveTo(tX(lon),tY(-10));ctx.lineTo(tX(lon),tY(60));ctx.stroke()}
-ctx.fillStyle='rgba(17,21,32,.7)';ctx.lineWidth=1;for(const[name,pts]of Object.entries(borders)){ctx.strokeStyle=name==='Iran'?'rgba(239,68,68,.25)':'#1a2035';ctx.lineWidth=name==='Iran'?2:1;ctx.beginPath();pts.forEach((p,i)=>{const x=tX(p[1]),y=tY(p[0]);i===0?ctx.moveTo(x,y):ctx.lineTo(x,y)});ctx.closePath();ctx.fill();ctx.stroke()}
-ctx.font='9px JetBrains Mono,monospace';ctx.fillStyle='#2a3450';ctx.textAlign='center';labels.forEach(([lat,t,lon])=>ctx.fillText(t,tX(lon),tY(lat)));
-ctx.setLineDash([3,3]);ctx.strokeStyle='#475569';ctx.lineWidth=1;bases.forEach(b=>{const x=tX(b.lon),y=tY(b.lat);ctx.beginPath();ctx.arc(x,y,4,0,Math.PI*2);ctx.stroke();ctx.font='8px JetBrains Mono,monospace';ctx.fillStyle='#475569';ctx.textAlign='left';ctx.fillText(b.name,x+7,y+3)});ctx.setLineDash([]);
-const ret=aircraft.filter(a=>a.status==='returning');const nw=aircraft.filter(a=>a.status!=='returning');
-ret.forEach(a=>{const x=tX(a.lon),y=tY(a.lat);ctx.beginPath();ctx.arc(x,y,3,0,Math.PI*2);ctx.fillStyle='#2a3450';ctx.fill()});
-nw.forEach(a=>{const x=tX(a.lon),y=tY(a.lat);const cat=getCat(a.callsign);const g=ctx.createRadialGradient(x,y,0,x,y,18);g.addColorStop(0,cat.c+'30');g.addColorStop(1,cat.c+'00');ctx.fillStyle=g;ctx.beginPath();ctx.arc(x,y,18,0,Math.PI*2);ctx.fill();ctx.beginPath();ctx.arc(x,y,4,0,Math.PI*2);ctx.fillStyle=cat.c+'90';ctx.fill();ctx.strokeStyle=cat.c;ctx.lineWidth=1.5;ctx.stroke();ctx.font='bold 9px JetBrains Mono,monospace';ctx.fillStyle=cat.c;ctx.textAlign='left';const lbl=a.callsign||a.registration||a.hex||'';ctx.fillText(lbl,x+9,y-3);ctx.font='8px JetBrains Mono,monospace';ctx.fillStyle='#94a3b8';ctx.fillText(a.airframe||cat.t,x+9,y+8)})}
-function resize(){W=wrap.clientWidth;H=wrap.clientHeight;canvas.width=W*devicePixelRatio;canvas.height=H*devicePixelRatio;canvas.style.width=W+'px';canvas.style.height=H+'px';ctx.setTransform(devicePixelRatio,0,0,devicePixelRatio,0,0);draw()}resize();window.addEventListener('resize',resize);
-let hov=null;wrap.addEventListener('mousemove',e=>{const r=canvas.getBoundingClientRect(),mx=e.clientX-r.left,my=e.clientY-r.top;let found=null;for(const a of aircraft){if(Math.hypot(mx-tX(a.lon),my-tY(a.lat))<16){found=a;break}}
-if(found&&found!==hov){hov=found;let h='<div style="font-weight:600;color:var(--cyan);font-size:12px">'+(found.callsign||found.registration||found.hex)+'</div>';if(found.airframe)h+='<div style="color:var(--text);margin-top:3px">'+found.airframe+'</div>';if(found.role)h+='<div style="color:var(--text2);font-size:10px">'+found.role+'</div>';if(found.location_desc)h+='<div style="color:var(--text3);margin-top:3px;font-size:10px">'+found.location_desc+'</div>';if(found.alt_ft)h+='<div style="color:var(--text4);font-size:10px">'+found.alt_ft.toLocaleString()+' ft'+(found.origin?' · '+found.origin:'')+'</div>';tip.innerHTML=h;tip.style.left=Math.min(mx+16,W-240)+'px';tip.style.top=(my-10)+'px';tip.style.opacity='1'}else if(!found){hov=null;tip.style.opacity='0'}});
-wrap.addEventListener('mouseleave',()=>{hov=null;tip.style.opacity='0'})})();
+function sX(n){return Math.floor(tX(n))+.5}function sY(t){return Math.floor(tY(t))+.5}
+let bOff=[],bLL=new Float32Array(0);function loadBorders(borders){bOff=[];bLL=new Float32Array(Object.values(borders).reduce((n,pts)=>n+pts.length*2,0));let o=0;for(const[name,pts]of Object.entries(borders)){const s=o;for(const p of pts){bLL[o++]=p[0];bLL[o++]=p[1]}bOff.push([name,s,o])}}
+let bXY,bPath,gridPath,baseXY,lblXY;function project(){bXY=new Float32Array(bLL.length);for(let i=0;i<bLL.length;i+=2){bXY[i]=sX(bLL[i+1]);bXY[i+1]=sY(bLL[i])}bPath={};for(const[name,s,e]of bOff){const path=new Path2D();path.moveTo(bXY[s],bXY[s+1]);for(let i=s+2;i<e;i+=2)path.lineTo(bXY[i],bXY[i+1]);path.closePath();bPath[name]=path}
+gridPath=new Path2D();for(let lat=-10;lat<=60;lat+=5){gridPath.moveTo(sX(10),sY(lat));gridPath.lineTo(sX(85),sY(lat))}for(let lon=10;lon<=85;lon+=5){gridPath.moveTo(sX(lon),sY(-10));gridPath.lineTo(sX(lon),sY(60))}baseXY=new Float32Array(bases.length*2);bases.forEach((b,i)=>{baseXY[2*i]=sX(b.lon);baseXY[2*i+1]=sY(b.lat)});lblXY=new Float32Array(labels.length*2);labels.forEach(([lat,,lon],i)=>{lblXY[2*i]=Math.round(tX(lon));lblXY[2*i+1]=Math.round(tY(lat))})}
+const CATS=[{p:['RCH','REACH','PACK','DUKE','MOOSE','FRED','CARGO','HERK'],t:'Airlift',c:'#ef4444'},{p:['ETHYL','JULIET','PEARL','STEEL','SHELL','TEAL','NKAC','PKSN','GOLD','BLUE','IRON'],t:'Tanker',c:'#3b82f6'},{p:['HOMER','TOPCT','JAKE','TITAN','FORTE','MAGIC','SNTRY','REDEYE','OLIVE','MAZDA'],t:'ISR/AWACS',c:'#f59e0b'},{p:['DOOM','DEATH','BATT','MYTEE','BONE','VIPER','EAGLE','RAZOR','HAWK','STRIKE','WRATH','BOLT','ASCOT','TABOR'],t:'Strike',c:'#22c55e'}];const MIL_CAT={t:'Military',c:'#94a3b8'};const catByPrefix=new Map();let minPx=99,maxPx=0;for(const g of CATS)for(const px of g.p){catByPrefix.set(px,g);minPx=Math.min(minPx,px.length);maxPx=Math.max(maxPx,px.length)}
+const catCache=new Map();function getCat(cs){cs=(cs||'').toUpperCase();let hit=catCache.get(cs);if(hit)return hit;hit=MIL_CAT;for(let n=Math.min(maxPx,cs.length);n>=minPx;n--){const g=catByPrefix.get(cs.slice(0,n));if(g){hit=g;break}}catCache.set(cs,hit);return hit}
+function drawBg(){bctx.fillStyle='#080a0f';bctx.fillRect(0,0,W,H);
+bctx.strokeStyle='rgba(26,32,53,.4)';bctx.lineWidth=.5;bctx.stroke(gridPath);
+bctx.fillStyle='rgba(17,21,32,.7)';bctx.lineWidth=1;for(const[name,path]of Object.entries(bPath)){bctx.strokeStyle=name==='Iran'?'rgba(239,68,68,.25)':'#1a2035';bctx.lineWidth=name==='Iran'?2:1;bctx.fill(path);bctx.stroke(path)}
+bctx.font='9px JetBrains Mono,monospace';bctx.fillStyle='#2a3450';bctx.textAlign='center';labels.forEach(([,t],i)=>bctx.fillText(t,lblXY[2*i],lblXY[2*i+1]));
+bctx.setLineDash([3,3]);bctx.strokeStyle='#475569';bctx.lineWidth=1;bctx.beginPath();for(let i=0;i<bases.length;i++){const x=baseXY[2*i],y=baseXY[2*i+1];bctx.moveTo(x+4,y);bctx.arc(x,y,4,0,Math.PI*2)}bctx.stroke();bctx.setLineDash([]);
+bctx.font='8px JetBrains Mono,monospace';bctx.fillStyle='#475569';bctx.textAlign='left';bases.forEach((b,i)=>bctx.fillText(b.name,baseXY[2*i]+7,baseXY[2*i+1]+3));}
+const glows=new Map();function glowSprite(c){let s=glows.get(c);if(!s){const d=mapDpr();s=document.createElement('canvas');s.width=s.height=36*d;const sx=s.getContext('2d');sx.scale(d,d);const g=sx.createRadialGradient(18,18,0,18,18,18);g.addColorStop(0,c+'30');g.addColorStop(1,c+'00');sx.fillStyle=g;sx.fillRect(0,0,36,36);glows.set(c,s)}return s}
+function drawAircraft(){ctx.clearRect(0,0,W,H);
+ctx.beginPath();const byCat=new Map();for(const i of acVis){const a=aircraft[i],x=acXY[2*i],y=acXY[2*i+1];if(a.status==='returning'){ctx.moveTo(x+3,y);ctx.arc(x,y,3,0,Math.PI*2);continue}
+const cat=getCat(a.callsign);let grp=byCat.get(cat.c);if(!grp)byCat.set(cat.c,grp={cat,list:[]});grp.list.push({a,x,y})}ctx.fillStyle='#2a3450';ctx.fill();
+ctx.textAlign='left';ctx.lineWidth=1.5;for(const{cat,list}of byCat.values()){const spr=glowSprite(cat.c);for(const{x,y}of list)ctx.drawImage(spr,x-18,y-18,36,36);
+ctx.beginPath();for(const{x,y}of list){ctx.moveTo(x+4,y);ctx.arc(x,y,4,0,Math.PI*2)}ctx.fillStyle=cat.c+'90';ctx.fill();ctx.strokeStyle=cat.c;ctx.stroke();
+ctx.font='bold 9px JetBrains Mono,monospace';ctx.fillStyle=cat.c;for(const{a,x,y}of list)ctx.fillText(a.callsign||a.registration||a.hex||'',x+9,y-3)}
+ctx.font='8px JetBrains Mono,monospace';ctx.fillStyle='#94a3b8';for(const{cat,list}of byCat.values())for(const{a,x,y}of list)ctx.fillText(a.airframe||cat.t,x+9,y+8)}
+const CELL=50;let acXY,acVis,hitGrid;function indexAircraft(){acXY=new Float32Array(aircraft.length*2);acVis=[];hitGrid=new Map();aircraft.forEach((a,i)=>{const x=Math.round(tX(a.lon)),y=Math.round(tY(a.lat)),k=Math.floor(x/CELL)+','+Math.floor(y/CELL);acXY[2*i]=x;acXY[2*i+1]=y;if(x<-120||x>W+20||y<-20||y>H+20)return;acVis.push(i);let b=hitGrid.get(k);if(!b)hitGrid.set(k,b=[]);b.push(i)})}
+function hitTest(mx,my){const gx=Math.floor(mx/CELL),gy=Math.floor(my/CELL);let best=-1;for(let dx=-1;dx<=1;dx++)for(let dy=-1;dy<=1;dy++){const b=hitGrid.get((gx+dx)+','+(gy+dy));if(b)for(const i of b){if(best>=0&&i>=best)continue;const ex=mx-acXY[2*i],ey=my-acXY[2*i+1];if(ex*ex+ey*ey<256)best=i}}return best<0?null:aircraft[best]}
+let bgDirty=false,acDirty=false,queued=false;function render(){queued=false;if(bgDirty){bgDirty=false;drawBg()}if(acDirty){acDirty=false;drawAircraft()}}
+function invalidate(bg){if(bg)bgDirty=true;acDirty=true;if(!queued){queued=true;requestAnimationFrame(render)}}
+function mapDpr(){return Math.min(devicePixelRatio||1,2)}
+function resize(){W=wrap.clientWidth;H=wrap.clientHeight;const d=mapDpr();for(const[c,x]of[[bgCanvas,bctx],[canvas,ctx]]){c.width=W*d;c.height=H*d;c.style.width=W+'px';c.style.height=H+'px';x.setTransform(d,0,0,d,0,0)}project();indexAircraft();invalidate(true)}resize();window.addEventListener('resize',resize);
+fetch('borders.json').then(r=>r.json()).then(b=>{loadBorders(b);project();invalidate(true)}).catch(()=>{});
+function esc(s){return String(s).replace(/[&<>"']/g,c=>({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'})[c])}const tipCache=new WeakMap();function tipHtml(a){let h=tipCache.get(a);if(h!==undefined)return h;h='<div style="font-weight:600;color:var(--cyan);font-size:12px">'+esc(a.callsign||a.registration||a.hex)+'</div>';if(a.airframe)h+='<div style="color:var(--text);margin-top:3px">'+esc(a.airframe)+'</div>';if(a.role)h+='<div style="color:var(--text2);font-size:10px">'+esc(a.role)+'</div>';if(a.location_desc)h+='<div style="color:var(--text3);margin-top:3px;font-size:10px">'+esc(a.location_desc)+'</div>';if(a.alt_ft)h+='<div style="color:var(--text4);font-size:10px">'+a.alt_ft.toLocaleString()+' ft'+(a.origin?' · '+esc(a.origin):'')+'</div>';tipCache.set(a,h);return h}
+let hov=null,mouse=null,tipQueued=false;function updateTip(){tipQueued=false;if(!mouse)return;const r=canvas.getBoundingClientRect(),mx=mouse.x-r.left,my=mouse.y-r.top;const found=hitTest(mx,my);
+if(found){if(found!==hov){hov=found;tip.innerHTML=tipHtml(found);tip.style.opacity='1'}tip.style.left=Math.min(mx+16,W-240)+'px';tip.style.top=(my-10)+'px'}else if(hov){hov=null;tip.style.opacity='0'}}
+wrap.addEventListener('mousemove',e=>{mouse={x:e.clientX,y:e.clientY};if(!tipQueued){tipQueued=true;requestAnimationFrame(updateTip)}});
+wrap.addEventListener('mouseleave',()=>{mouse=null;hov=null;tip.style.opacity='0'})})();
 </script></body></html>"""
 
 
@@ -1254,26 +1795,34 @@ wrap.addEventListener('mouseleave',()=>{hov=null;tip.style.opacity='0'})})();
 # ──────────────────────────────────────────────────────────────
 
 def main():
+    # One clock reading for the whole run, so the page, the prompt, the trend windows and the
+    # saved snapshot all carry the same time
+    now = datetime.now(timezone.utc)
     print("=" * 60)
-    print(f"IRAN WATCH — Update ({datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M UTC')})")
+    print(f"IRAN WATCH — Update ({now.strftime('%Y-%m-%d %H:%M UTC')})")
     print("=" * 60)
 
     # 0. Load history
-    snapshots = load_history(days=7)
-    prev_callsigns = set()
+    snapshots = load_history(days=7, now=now)
+    # Read-only from here on: only membership tests against it when tagging aircraft
+    prev_callsigns = frozenset(snapshots[-1].get("callsigns", [])) if snapshots else frozenset()
     if snapshots:
-        latest = snapshots[-1]
-        prev_callsigns = set(latest.get("callsigns", []))
         print(f"[History] Previous snapshot has {len(prev_callsigns)} callsigns")
 
-    # 1. Fetch all data sources in parallel-ish order
-    aircraft = fetch_aircraft()
-    polymarket = fetch_polymarket()
-    kalshi = fetch_kalshi()
-    metaculus = fetch_metaculus()
-    centcom = fetch_centcom_rss()
-    naval = fetch_naval()
-    diplomatic = fetch_diplomatic_context()
+    # 1. Fetch all data sources in parallel — each fetcher is network-bound and
+    #    catches its own errors, so the slowest source sets the wall time
+    fetchers = {
+        "aircraft": fetch_aircraft, "polymarket": lambda: cached_fetch("polymarket", fetch_polymarket, "markets"),
+        "kalshi": fetch_kalshi, "metaculus": lambda: cached_fetch("metaculus", fetch_metaculus, "questions"),
+        "centcom": fetch_centcom_rss, "naval": fetch_naval,
+        "diplomatic": fetch_diplomatic_context,
+    }
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as ex:
+        futures = {name: ex.submit(fn) for name, fn in fetchers.items()}
+    results = {name: fut.result() for name, fut in futures.items()}
+    aircraft, polymarket, kalshi = results["aircraft"], results["polymarket"], results["kalshi"]
+    metaculus, centcom = results["metaculus"], results["centcom"]
+    naval, diplomatic = results["naval"], results["diplomatic"]
 
     # 2. Tag aircraft as new/returning
     current_callsigns = set()
@@ -1284,19 +1833,23 @@ def main():
 
     # 3. Compute trends
     all_markets = polymarket.get("markets", []) + kalshi.get("markets", [])
-    market_trends = compute_trends(snapshots, all_markets)
+    market_trends = compute_trends(snapshots, all_markets, now=now)
     ac_baseline = compute_aircraft_baseline(snapshots)
 
     # 4. Generate analysis
-    analysis = generate_analysis(aircraft, polymarket, metaculus, centcom, naval, diplomatic, kalshi, ac_baseline, market_trends)
+    analysis = generate_analysis(aircraft, polymarket, metaculus, centcom, naval, diplomatic, kalshi, ac_baseline, market_trends, now=now)
 
     # 5. Generate HTML
-    html = generate_html(analysis, aircraft, polymarket, metaculus, centcom, naval, kalshi, market_trends, ac_baseline, snapshots)
+    html = generate_html(analysis, aircraft, polymarket, metaculus, centcom, naval, kalshi, market_trends, ac_baseline, snapshots, now=now)
 
     # 6. Write output
-    output_path = os.path.join(os.path.dirname(__file__) or ".", "index.html")
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html)
+    output_dir = os.path.dirname(__file__) or "."
+    output_path = os.path.join(output_dir, "index.html")
+    # Encode once, write once, then swap into place so Pages never serves a half-written file
+    with open(output_path + ".tmp", "wb") as f:
+        f.write(html.encode("utf-8"))
+    os.replace(output_path + ".tmp", output_path)
+    write_static_assets(output_dir)
 
     # 7. Save snapshot for future comparisons
     snapshot_data = {
@@ -1305,8 +1858,8 @@ def main():
         "markets": [{"question": m["question"], "probability": m["probability"],
                      "volume": m.get("volume", "0")} for m in all_markets],
     }
-    save_snapshot(snapshot_data)
-    cleanup_old_history()
+    save_snapshot(snapshot_data, now=now)
+    cleanup_old_history(now=now)
 
     print(f"\n{'='*60}")
     print(f"[Done] Written to {output_path}")